@@ -0,0 +1,65 @@
+"""
+Second-level cache for related objects loaded by MongoDBManyToManyFields.
+
+MongoDBManyToManyField(cache='default', cache_timeout=300) keeps the related
+documents in the given Django cache backend. The relation managers look them
+up with get_many() before querying MongoDB. Saving or deleting a related object
+through Django removes it from the cache, but changes made with raw updates or
+QuerySet.update() are only seen when the cached copies time out.
+"""
+from django.core.cache import get_cache
+
+# ObjectId has been moved to bson.objectid in newer versions of PyMongo
+try:
+    from bson.objectid import ObjectId
+except ImportError:
+    from pymongo.objectid import ObjectId
+
+# Prefix of the cache keys, followed by app label, model name and ObjectId
+KEY_PREFIX = 'mongom2m'
+
+class RelatedObjectCache(object):
+    """
+    Caches the serialized documents of one related model. The codec converts the
+    instances to documents and back. The number of cache hits and misses are
+    counted in hits and misses.
+    """
+    def __init__(self, model, codec, alias='default', timeout=300):
+        self.model = model
+        self.codec = codec
+        self.cache = get_cache(alias)
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._key_prefix = '%s:%s.%s:' % (KEY_PREFIX, model._meta.app_label, model._meta.object_name.lower())
+    
+    def make_key(self, pk):
+        return self._key_prefix + str(pk)
+    
+    def get_many(self, pks):
+        """
+        Return a dict that maps the given ObjectIds to the cached instances.
+        """
+        keys = dict((self.make_key(pk), pk) for pk in pks)
+        found = {}
+        for key, value in self.cache.get_many(keys.keys()).items():
+            obj = self.codec.decode(value)
+            if obj is not None:
+                found[keys[key]] = obj
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+    
+    def set_many(self, objs):
+        """
+        Store the given model instances in the cache.
+        """
+        if objs:
+            self.cache.set_many(dict((self.make_key(ObjectId(obj.pk)), self.codec.encode(obj)) for obj in objs), self.timeout)
+    
+    def delete(self, pk):
+        self.cache.delete(self.make_key(ObjectId(pk)))
+    
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
@@ -2,57 +2,696 @@ from djangotoolbox.fields import ListField, DictField, EmbeddedModelField, Abstr
 from django.db.models.signals import m2m_changed
 from django.db.models import get_model
 from django.db.models.fields.related import add_lazy_relation
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.query_utils import DeferredAttribute, deferred_class_factory
+from django.db.models.sql.constants import LOOKUP_SEP
 from django.utils.translation import ugettext_lazy as _
 from django_mongodb_engine.contrib import MongoDBManager
 from django.forms import ModelMultipleChoiceField
-from django.db import models
+from django.db import models, connections
+from mongom2m.identitymap import get_identity_map
+from mongom2m.cache import RelatedObjectCache
+from mongom2m import instrumentation
+from contextlib import contextmanager
+from itertools import islice
+import threading
+import time
 
 # How much to show when query set is viewed in the Python shell
 REPR_OUTPUT_SIZE = 20
 
+# How many related objects to load with a single {_id: {$in: [...]}} query
+LOAD_CHUNK_SIZE = 500
+
+# What to do when a related object referred to by a relation no longer exists:
+# raise DoesNotExist, leave the object out, or return None in its place
+MISSING_RAISE = 'raise'
+MISSING_SKIP = 'skip'
+MISSING_NONE = 'none'
+
+# Key of the marker stored at the end of a relation list whose overflow is in the side collection
+OVERFLOW_KEY = '_overflow'
+
 # ObjectId has been moved to bson.objectid in newer versions of PyMongo
 try:
     from bson.objectid import ObjectId
 except ImportError:
     from pymongo.objectid import ObjectId
 
+class _RelatedObject(object):
+    """
+    Internal representation of one related object: its ObjectId and the model
+    instance once it has been loaded. An embedded value from the database is
+    kept raw and only converted to a model instance when obj is first accessed.
+    Slots keep the memory use low on large relations.
+    """
+    __slots__ = ('pk', '_obj', '_raw', '_codec')
+    
+    def __init__(self, pk, obj=None, raw=None, codec=None):
+        self.pk = pk
+        self._obj = obj
+        self._raw = raw
+        self._codec = codec
+    
+    def _get_obj(self):
+        if self._raw is not None:
+            self._obj = self._codec.decode(self._raw)
+            self._raw = self._codec = None
+        return self._obj
+    
+    def _set_obj(self, obj):
+        self._obj = obj
+        self._raw = self._codec = None
+    
+    obj = property(_get_obj, _set_obj)
+
+class _RelationCodec(object):
+    """
+    Converts related model instances to the values stored in the relation list
+    and back. The field metadata is resolved once per relation when the codec
+    is created, so converting each element only does the actual work.
+    embed_fields is the list of fields to store in embedded copies, or None
+    to store only the ObjectId.
+    """
+    def __init__(self, model, embed_fields, field=None):
+        self.model = model
+        self.field = field
+        self.pk_column = model._meta.pk.column
+        self.embed_fields = embed_fields
+        self._all_fields = len(embed_fields or ()) == len(model._meta.fields)
+        # (column, attname, custom pre_save or None, get_db_prep_value) for encoding
+        self._encoders = []
+        for field in embed_fields or ():
+            pre_save = field.pre_save if field.pre_save.im_func is not models.Field.pre_save.im_func else None
+            self._encoders.append((field.column, field.attname, pre_save, field.get_db_prep_value))
+        # (column, attname) in model field order for decoding
+        self._decoders = [(field.column, str(field.attname)) for field in model._meta.fields]
+        self._deferred_classes = {}
+        self._connection = None
+    
+    def encode(self, instance):
+        """
+        Convert a model instance to an embedded dict, or a dict containing only
+        the ObjectId if nothing is embedded.
+        """
+        if instrumentation.active and self.field is not None:
+            start = time.time()
+            value = self._encode(instance)
+            instrumentation.record_time(self.field, 'encode_time', time.time() - start)
+            return value
+        return self._encode(instance)
+    
+    def _encode(self, instance):
+        if not self.embed_fields:
+            return {self.pk_column:ObjectId(instance.pk)}
+        if self._connection is None:
+            self._connection = connections['default']
+        connection = self._connection
+        values = {}
+        for column, attname, pre_save, get_db_prep_value in self._encoders:
+            value = pre_save(instance, True) if pre_save else getattr(instance, attname)
+            values[column] = get_db_prep_value(value, connection=connection)
+        # Convert primary key into an ObjectId so it's stored correctly
+        values[self.pk_column] = ObjectId(values[self.pk_column])
+        return values
+    
+    def decode(self, value):
+        """
+        Convert an embedded dict to a model instance. Fields missing from the dict
+        are deferred. Returns None if the dict contains nothing but the id.
+        """
+        if instrumentation.active and self.field is not None:
+            start = time.time()
+            obj = self._decode(value)
+            instrumentation.record_time(self.field, 'decode_time', time.time() - start)
+            return obj
+        return self._decode(value)
+    
+    def _decode(self, value):
+        if self._all_fields and len(value) == len(self._decoders):
+            # Fast path: all fields are there, create the instance from positional args
+            try:
+                obj = self.model(*[value[column] for column, attname in self._decoders])
+            except KeyError:
+                obj = None
+            if obj is not None:
+                # Make sure the pk in the model instance is a string (not ObjectId) to be compatible with django-mongodb-engine
+                if isinstance(obj.pk, ObjectId):
+                    obj.pk = str(obj.pk)
+                return obj
+        data = {}
+        deferred = []
+        for column, attname in self._decoders:
+            if column in value:
+                data[attname] = value[column]
+            else:
+                deferred.append(attname)
+        # If we only got the id, give up to avoid creating an invalid/empty model instance
+        if len(data) <= 1:
+            return None
+        if deferred:
+            # The missing fields are loaded from the db when accessed
+            key = tuple(deferred)
+            model = self._deferred_classes.get(key)
+            if model is None:
+                model = self._deferred_classes[key] = deferred_class_factory(self.model, deferred)
+            obj = model(**data)
+        else:
+            obj = self.model(**data)
+        # Make sure the pk in the model instance is a string (not ObjectId) to be compatible with django-mongodb-engine
+        if isinstance(obj.pk, ObjectId):
+            obj.pk = str(obj.pk)
+        return obj
+
+def _get_collection(model, using='default'):
+    """
+    Return the raw PyMongo collection that stores the given model.
+    """
+    return connections[using].get_collection(model._meta.db_table)
+
+def _aggregate(collection, pipeline):
+    """
+    Run an aggregation pipeline and return the result documents as a list.
+    """
+    result = collection.aggregate(pipeline)
+    if isinstance(result, dict):
+        # Older PyMongo versions return the whole result in one document
+        result = result['result']
+    return list(result)
+
+def _fetch_objects(model, pks, cache=None):
+    """
+    Load the model instances with the given ObjectIds using a single
+    {_id: {$in: [...]}} query. Returns a dict that maps ObjectIds to instances.
+    Primary keys that don't exist in the database are not in the dict.
+    Instances in the active identity map, or in the given RelatedObjectCache,
+    are used instead of querying them.
+    """
+    if not pks: return {}
+    identity_map = get_identity_map()
+    if identity_map is None and cache is None:
+        found = dict((ObjectId(obj.pk), obj) for obj in model.objects.filter(pk__in=list(pks)))
+        if instrumentation.active:
+            instrumentation.record_query(len(found))
+        return found
+    found = identity_map.get_many(model, pks) if identity_map is not None else {}
+    pks = [pk for pk in pks if pk not in found]
+    if pks and cache is not None:
+        cached = cache.get_many(pks)
+        found.update(cached)
+        pks = [pk for pk in pks if pk not in cached]
+        if instrumentation.active:
+            instrumentation.record_cache_hits(len(cached))
+    else:
+        cached = {}
+    if pks:
+        fetched = list(model.objects.filter(pk__in=pks))
+        if instrumentation.active:
+            instrumentation.record_query(len(fetched))
+        if cache is not None:
+            cache.set_many(fetched)
+        for obj in fetched:
+            found[ObjectId(obj.pk)] = obj
+        cached.update((ObjectId(obj.pk), obj) for obj in fetched)
+    if identity_map is not None:
+        for obj in cached.values():
+            identity_map.add(model, obj)
+    return found
+
+def _fetch_object(model, pk, cache=None):
+    """
+    Load a single model instance, using the active identity map and the given
+    RelatedObjectCache if possible. Raises DoesNotExist if it doesn't exist.
+    """
+    identity_map = get_identity_map()
+    obj = identity_map.get(model, pk) if identity_map is not None else None
+    if obj is None:
+        obj = cache.get_many([ObjectId(pk)]).get(ObjectId(pk)) if cache is not None else None
+        if obj is not None:
+            if instrumentation.active:
+                instrumentation.record_cache_hits(1)
+        else:
+            if instrumentation.active:
+                instrumentation.record_query(1)
+            obj = model.objects.get(pk=pk)
+            if cache is not None:
+                cache.set_many([obj])
+        if identity_map is not None:
+            identity_map.add(model, obj)
+    return obj
+
+def _fetch_related_objects(field, pks):
+    """
+    Load the related objects of the field with _fetch_objects(), using the
+    field's cache and tracking the load when instrumentation is active.
+    """
+    if instrumentation.active:
+        return instrumentation.track_load(field, list(pks), lambda: _fetch_objects(field.rel.to, pks, field.related_cache))
+    return _fetch_objects(field.rel.to, pks, field.related_cache)
+
+def _fetch_related_object(field, pk):
+    """
+    Load one related object of the field with _fetch_object(), using the
+    field's cache and tracking the load when instrumentation is active.
+    """
+    if instrumentation.active:
+        return instrumentation.track_load(field, [ObjectId(pk)], lambda: _fetch_object(field.rel.to, pk, field.related_cache), single=True)
+    return _fetch_object(field.rel.to, pk, field.related_cache)
+
+def _load_objects(rel, objects, missing=MISSING_RAISE):
+    """
+    Load the model instances of all not yet loaded objects in the internal objects
+    list, with one query per LOAD_CHUNK_SIZE objects. The instances are stored in
+    the objects so they are kept in memory.
+    """
+    for start in xrange(0, len(objects), LOAD_CHUNK_SIZE):
+        chunk = objects[start:start + LOAD_CHUNK_SIZE]
+        pks = set(obj.pk for obj in chunk if not obj.obj)
+        if not pks:
+            continue
+        loaded = _fetch_related_objects(rel.field, pks)
+        if missing == MISSING_RAISE and len(loaded) < len(pks):
+            missing_pks = sorted(str(pk) for pk in pks if pk not in loaded)
+            raise rel.to.DoesNotExist('%s matching ids %s do not exist' % (rel.to._meta.object_name, ', '.join(missing_pks)))
+        for obj in chunk:
+            if not obj.obj:
+                obj.obj = loaded.get(obj.pk)
+
+def _chunks(objects, size):
+    """
+    Split the internal objects into lists of size objects. Lists are sliced, other
+    sequences are iterated once, as slicing them queries. A _ReverseObjectList
+    loads size objects per query.
+    """
+    if isinstance(objects, list):
+        for start in xrange(0, len(objects), size):
+            yield objects[start:start + size]
+        return
+    objects = objects.iterator(size) if isinstance(objects, _ReverseObjectList) else iter(objects)
+    while True:
+        chunk = list(islice(objects, size))
+        if not chunk:
+            break
+        yield chunk
+
+def _iter_objects(rel, objects, missing=MISSING_RAISE):
+    """
+    Iterate the internal objects list in stored order, loading the model instances
+    in chunks as needed. Yields the internal objects, whose obj key is None only if
+    the related object doesn't exist and missing is MISSING_NONE.
+    """
+    for chunk in _chunks(objects, LOAD_CHUNK_SIZE):
+        _load_objects(rel, chunk, missing)
+        for obj in chunk:
+            if obj.obj or missing == MISSING_NONE:
+                yield obj
+
+# Lookups that can be evaluated in Python against instances that are already in memory
+LOADED_LOOKUPS = {
+    'exact': lambda value, arg: value == arg,
+    'iexact': lambda value, arg: value is not None and value.lower() == arg.lower(),
+    'in': lambda value, arg: value in arg,
+    'contains': lambda value, arg: value is not None and arg in value,
+    'icontains': lambda value, arg: value is not None and arg.lower() in value.lower(),
+    'startswith': lambda value, arg: value is not None and value.startswith(arg),
+    'istartswith': lambda value, arg: value is not None and value.lower().startswith(arg.lower()),
+    'endswith': lambda value, arg: value is not None and value.endswith(arg),
+    'iendswith': lambda value, arg: value is not None and value.lower().endswith(arg.lower()),
+    'gt': lambda value, arg: value > arg,
+    'gte': lambda value, arg: value >= arg,
+    'lt': lambda value, arg: value < arg,
+    'lte': lambda value, arg: value <= arg,
+    'isnull': lambda value, arg: (value is None) == arg,
+}
+
+def _loaded_value_getter(model, name, deferred=()):
+    """
+    Return a function that gets the value of the named field from an instance,
+    or None if the field can't be compared in Python or is in deferred.
+    """
+    if name in ('pk', model._meta.pk.name):
+        return lambda instance: ObjectId(instance.pk)
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    if field.rel or field.attname in deferred:
+        return None
+    attname = field.attname
+    return lambda instance: getattr(instance, attname)
+
+def _loaded_lookup_matcher(model, lookup, arg, deferred=()):
+    """
+    Return a function that tells whether an instance matches a filter() lookup,
+    or None if the lookup can't be evaluated in Python.
+    """
+    parts = lookup.split(LOOKUP_SEP)
+    if len(parts) > 2:
+        return None
+    name, lookup_type = parts[0], (parts[1] if len(parts) == 2 else 'exact')
+    getter = _loaded_value_getter(model, name, deferred)
+    if not getter or lookup_type not in LOADED_LOOKUPS:
+        return None
+    if name in ('pk', model._meta.pk.name):
+        # Compare primary keys as ObjectIds
+        if lookup_type == 'exact':
+            arg = ObjectId(arg)
+        elif lookup_type == 'in':
+            arg = set(ObjectId(pk) for pk in arg)
+        else:
+            return None
+    test = LOADED_LOOKUPS[lookup_type]
+    return lambda instance: test(getter(instance), arg)
+
+def prefetch_m2m(instances, *field_names):
+    """
+    Load the related objects of the named MongoDBManyToManyFields for all the
+    given model instances (or query set) at once. The referenced ObjectIds are
+    collected from all instances and fetched with one query per related model
+    (and LOAD_CHUNK_SIZE objects), so accessing the relations afterwards won't
+    cause any more queries. Returns the instances as a list.
+    
+    For example, to list articles with their categories and tags:
+    
+    articles = prefetch_m2m(TestArticle.objects.all(), 'categories', 'tags')
+    """
+    instances = list(instances)
+    # Collect the unloaded objects of all the relations, grouped by related model
+    objects_by_model = {}
+    field_by_model = {}
+    for field_name in field_names:
+        for instance in instances:
+            manager = getattr(instance, field_name)
+            objects_by_model.setdefault(manager.rel.to, []).extend(obj for obj in manager.objects if not obj.obj)
+            # Use the cache of a field that has one
+            if manager.rel.to not in field_by_model or field_by_model[manager.rel.to].related_cache is None:
+                field_by_model[manager.rel.to] = manager.field
+    for model, objects in objects_by_model.items():
+        pks = list(set(obj.pk for obj in objects))
+        loaded = {}
+        for start in xrange(0, len(pks), LOAD_CHUNK_SIZE):
+            loaded.update(_fetch_related_objects(field_by_model[model], pks[start:start + LOAD_CHUNK_SIZE]))
+        # Objects that don't exist are left unloaded and handled when accessed
+        for obj in objects:
+            obj.obj = loaded.get(obj.pk)
+    return instances
+
+def prefetch_reverse(instances, related_name, counts_only=False, fields=None):
+    """
+    Load the objects that refer to each of the given model instances (or query
+    set) through the named reverse relation, with a single {column.id: {$in: [...]}}
+    query, and attach them to the instances' reverse managers. Accessing all(),
+    count() or exists() on them then won't cause any more queries. Returns the
+    instances as a list.
+    
+    With counts_only=True, only the number of referring objects is counted with
+    an aggregation. fields limits the loaded fields of the referring objects, the
+    rest are deferred.
+    
+    For example, to list categories with their article counts:
+    
+    categories = prefetch_reverse(TestCategory.objects.all(), 'testarticle_set', counts_only=True)
+    """
+    instances = list(instances)
+    if not instances:
+        return instances
+    descriptor = getattr(instances[0].__class__, related_name)
+    field = descriptor.field
+    model = descriptor.model
+    pks = list(set(ObjectId(instance.pk) for instance in instances))
+    path = field.column + '.' + field.rel.to._meta.pk.column
+    if counts_only:
+        pipeline = [{'$match':{path:{'$in':pks}}}, {'$unwind':'$' + field.column}, {'$match':{path:{'$in':pks}}}, {'$group':{'_id':'$' + path, 'count':{'$sum':1}}}]
+        counts = dict((row['_id'], row['count']) for row in _aggregate(_get_collection(model), pipeline))
+        if field.overflow_threshold is not None:
+            pipeline = [{'$match':{'related':{'$in':pks}}}, {'$group':{'_id':'$related', 'count':{'$sum':1}}}]
+            for row in _aggregate(field.overflow_collection(), pipeline):
+                counts[row['_id']] = counts.get(row['_id'], 0) + row['count']
+        for instance in instances:
+            instance.__dict__.setdefault('_mongom2m_prefetched', {})[related_name] = {'count':counts.get(ObjectId(instance.pk), 0)}
+        return instances
+    # Pairs of (parent id, related id) from the overflow, whose parents are loaded too
+    overflow = []
+    if field.overflow_threshold is not None:
+        overflow = [(row['parent'], row['related']) for row in field.overflow_collection().find({'related':{'$in':pks}}, fields=['parent', 'related'])]
+    spec = {path:{'$in':pks}}
+    if overflow:
+        spec = {'$or':[spec, {'_id':{'$in':list(set(parent for parent, related in overflow))}}]}
+    queryset = model._default_manager.raw_query(spec)
+    if fields:
+        queryset = queryset.only(field.name, *fields)
+    objects_by_pk = dict((pk, []) for pk in pks)
+    parents = {}
+    for parent in queryset:
+        parents[ObjectId(parent.pk)] = parent
+        # Only the stored list, the overflow is not loaded
+        for obj in getattr(parent, field.name)._get_inline_objects():
+            if obj.pk in objects_by_pk:
+                objects_by_pk[obj.pk].append(parent)
+    for parent_pk, pk in overflow:
+        if parent_pk in parents:
+            objects_by_pk[pk].append(parents[parent_pk])
+    for instance in instances:
+        instance.__dict__.setdefault('_mongom2m_prefetched', {})[related_name] = {'objects':objects_by_pk[ObjectId(instance.pk)]}
+    return instances
+
+# Embedded copies to resync at the end of deferred_resync() blocks, per thread
+_resync_state = threading.local()
+
+@contextmanager
+def deferred_resync():
+    """
+    Defer resyncing embedded copies of related objects (see the resync_embedded
+    option of MongoDBManyToManyField) until the end of the block. Each changed
+    object is then written once however many times it was saved, and deleted
+    objects are pulled with one update per field. Nested blocks are flushed by
+    the outermost one.
+    """
+    if getattr(_resync_state, 'queue', None) is not None:
+        yield
+        return
+    _resync_state.queue = queue = {}
+    try:
+        yield
+    finally:
+        _resync_state.queue = None
+        for field, (saved, deleted) in queue.items():
+            field.resync_embedded(saved.values(), deleted)
+
 class MongoDBM2MQuerySet(object):
     """
     Helper for returning a set of objects from the managers.
     Works similarly to Django's own query set objects.
-    Lazily loads non-embedded objects when iterated.
-    If embed=False, objects are always loaded from database.
+    Lazily loads non-embedded objects when iterated, LOAD_CHUNK_SIZE objects
+    per query. If embed=False, objects are always loaded from database.
+    
+    The missing parameter decides what happens to related objects that no longer
+    exist in the database: MISSING_RAISE raises DoesNotExist, MISSING_SKIP leaves
+    them out and MISSING_NONE returns None in their place.
+    
+    filter() and order_by() are run as a query on the related collection that is
+    limited to the stored ids, so only the requested slice is loaded. If all the
+    objects are already in memory (e.g. embedded) and the lookups are simple
+    enough, they are evaluated in Python instead.
+    
+    values_list() and values() read the embedded values and the ids without
+    creating model instances, and query only the requested fields of the rest.
+    only() and defer() load the objects that are not in memory with the other
+    fields deferred.
     """
-    def __init__(self, rel, model, objects, use_cached, appear_as_relationship=(None, None, None, None, None)):
+    def __init__(self, rel, model, objects, use_cached, appear_as_relationship=(None, None, None, None, None), missing=MISSING_RAISE):
         self.db = 'default'
         self.rel = rel
-        self.objects = list(objects) # make a copy of the list to avoid problems
+        self.missing = missing
+        self._objects = objects # shared with the manager, so never modified here
+        self._use_cached = use_cached
         self.model = model
+        self._appear_as_relationship = appear_as_relationship
         self.appear_as_relationship_model, self.rel_model_instance, self.rel_to_instance, self.rel_model_name, self.rel_to_name = appear_as_relationship # appear as an intermediate m2m model
         if self.appear_as_relationship_model:
             self.model = self.appear_as_relationship_model
-        if not use_cached:
-            # Reset any cached instances
-            self.objects = [{'pk':obj['pk'], 'obj':None} for obj in self.objects]
+        # Query to run on the related collection, and its cached result
+        self._filters = []
+        self._ordering = ()
+        self._low = 0
+        self._high = None
+        self._result = None
+        # ('only' or 'defer', field names) to load the objects that aren't in memory with
+        self._load_fields = None
+    
+    @property
+    def objects(self):
+        if not self._use_cached:
+            # Ignore any cached instances, fresh ones are loaded when needed
+            self._objects = [_RelatedObject(obj.pk) for obj in self._objects]
+            self._use_cached = True
+        return self._objects
+    
+    def _clone(self, objects=None):
+        clone = MongoDBM2MQuerySet(self.rel, self.rel.to, self.objects if objects is None else objects, use_cached=True, appear_as_relationship=self._appear_as_relationship, missing=self.missing)
+        clone.db = self.db
+        clone._filters = list(self._filters)
+        clone._ordering = self._ordering
+        clone._low = self._low
+        clone._high = self._high
+        clone._load_fields = self._load_fields
+        return clone
+    
+    def _is_query(self):
+        return bool(self._filters or self._ordering)
+    
+    def _set_limits(self, low=None, high=None):
+        # Same logic as in Django's Query.set_limits
+        if high is not None:
+            if self._high is not None:
+                self._high = min(self._high, self._low + high)
+            else:
+                self._high = self._low + high
+        if low is not None:
+            if self._high is not None:
+                self._low = min(self._high, self._low + low)
+            else:
+                self._low = self._low + low
+    
+    def _get_objects(self):
+        """
+        Return the internal objects this query set contains, running the
+        query first if there is one.
+        """
+        if not self._is_query():
+            return self.objects
+        if self._result is None:
+            result = None
+            if all(obj.obj for obj in self.objects):
+                result = self._query_loaded()
+            if result is None:
+                result = self._query_db()
+            self._result = result
+        return self._result
+    
+    def _query_loaded(self):
+        """
+        Answer the query from the instances that are already in memory, without
+        accessing the database. Returns None if the query can't be evaluated in Python.
+        """
+        result = self.objects
+        # Fields that are not embedded would be loaded from the db one instance at a time
+        deferred = set()
+        for cls in set(type(obj.obj) for obj in result):
+            deferred.update(name for name, value in cls.__dict__.items() if isinstance(value, DeferredAttribute))
+        for args, kwargs in self._filters:
+            if args:
+                # Q objects are left to the database
+                return None
+            matchers = []
+            for lookup, value in kwargs.items():
+                matcher = _loaded_lookup_matcher(self.rel.to, lookup, value, deferred)
+                if not matcher:
+                    return None
+                matchers.append(matcher)
+            result = [obj for obj in result if all(matcher(obj.obj) for matcher in matchers)]
+        # Sort by the last field first, Python's sort is stable
+        for name in reversed(self._ordering):
+            getter = _loaded_value_getter(self.rel.to, name.lstrip('-'), deferred)
+            if not getter:
+                return None
+            result = sorted(result, key=lambda obj: getter(obj.obj), reverse=name.startswith('-'))
+        return result[self._low:self._high]
+    
+    def _query_db(self):
+        """
+        Run the query on the related collection, limited to the stored ids.
+        """
+        queryset = self.rel.to.objects.using(self.db).filter(pk__in=[obj.pk for obj in self.objects])
+        for args, kwargs in self._filters:
+            queryset = queryset.filter(*args, **kwargs)
+        if self._ordering:
+            # Let MongoDB sort, skip and limit so only the requested slice is transferred
+            queryset = queryset.order_by(*self._ordering)
+            if self._high is not None:
+                queryset = queryset[self._low:self._high]
+            elif self._low:
+                queryset = queryset[self._low:]
+            result = [_RelatedObject(ObjectId(obj.pk), obj) for obj in queryset]
+            if instrumentation.active:
+                instrumentation.record_query(len(result), self.rel.field)
+            return result
+        # Keep the stored order: find the matching ids only and load the slice when iterated
+        matching = set(ObjectId(pk) for pk in queryset.values_list('pk', flat=True))
+        if instrumentation.active:
+            instrumentation.record_query(len(matching), self.rel.field)
+        return [obj for obj in self.objects if obj.pk in matching][self._low:self._high]
     
     def _get_obj(self, obj):
-        if not obj['obj']:
+        if not obj.obj and self._load_fields:
+            # Load with deferred fields, without keeping it
+            loaded = self._fetch_chunk([obj.pk])
+            if obj.pk not in loaded:
+                raise self.rel.to.DoesNotExist('%s matching ids %s do not exist' % (self.rel.to._meta.object_name, obj.pk))
+            return self._wrap_obj(_RelatedObject(obj.pk, loaded[obj.pk]))
+        if not obj.obj:
             # Load referred instance from db and keep in memory
-            obj['obj'] = self.rel.to.objects.get(pk=obj['pk'])
+            obj.obj = _fetch_related_object(self.rel.field, obj.pk)
+        return self._wrap_obj(obj)
+    
+    def _wrap_obj(self, obj):
+        if obj.obj is None:
+            # Related object doesn't exist and missing is MISSING_NONE
+            return None
         if self.appear_as_relationship_model:
             # Wrap us in a relationship class
             if self.rel_model_instance:
-                args = { 'pk':str(self.rel_model_instance.pk) + '$f$' + str(obj['pk']), self.rel_model_name:self.rel_model_instance, self.rel_to_name:obj['obj'] }
+                args = { 'pk':str(self.rel_model_instance.pk) + '$f$' + str(obj.pk), self.rel_model_name:self.rel_model_instance, self.rel_to_name:obj.obj }
             else:
                 # Reverse
-                args = { 'pk':str(self.rel_to_instance.pk) + '$r$' + str(obj['pk']), self.rel_model_name:obj['obj'], self.rel_to_name:self.rel_to_instance }
+                args = { 'pk':str(self.rel_to_instance.pk) + '$r$' + str(obj.pk), self.rel_model_name:obj.obj, self.rel_to_name:self.rel_to_instance }
             wrapper = self.appear_as_relationship_model(**args)
             return wrapper
-        return obj['obj']
+        return obj.obj
     
     def __iter__(self):
-        for obj in self.objects:
-            yield self._get_obj(obj)
+        if self._load_fields:
+            # The instances with deferred fields are not kept
+            for obj in self.iterator():
+                yield obj
+            return
+        for obj in _iter_objects(self.rel, self._get_objects(), self.missing):
+            yield self._wrap_obj(obj)
+    
+    def _fetch_chunk(self, pks):
+        """
+        Load the related objects with the given ObjectIds, with only() or defer() applied.
+        """
+        if not self._load_fields:
+            return _fetch_related_objects(self.rel.field, pks)
+        method, names = self._load_fields
+        queryset = getattr(self.rel.to.objects.using(self.db).filter(pk__in=list(pks)), method)(*names)
+        loaded = dict((ObjectId(obj.pk), obj) for obj in queryset)
+        if instrumentation.active:
+            instrumentation.record_query(len(loaded), self.rel.field)
+        return loaded
+    
+    def iterator(self, chunk_size=LOAD_CHUNK_SIZE):
+        """
+        Iterate over the related objects without keeping the instances in memory.
+        The objects that aren't loaded yet are loaded chunk_size objects per query
+        and embedded values are converted as they are yielded, so only one chunk
+        of instances is alive at a time even on huge relations.
+        """
+        for chunk in _chunks(self._get_objects(), chunk_size):
+            pks = set(obj.pk for obj in chunk if obj._obj is None and obj._raw is None)
+            loaded = self._fetch_chunk(pks) if pks else {}
+            if self.missing == MISSING_RAISE and len(loaded) < len(pks):
+                missing_pks = sorted(str(pk) for pk in pks if pk not in loaded)
+                raise self.rel.to.DoesNotExist('%s matching ids %s do not exist' % (self.rel.to._meta.object_name, ', '.join(missing_pks)))
+            for obj in chunk:
+                if obj._raw is not None:
+                    instance = obj._codec.decode(obj._raw)
+                else:
+                    instance = obj._obj or loaded.get(obj.pk)
+                if instance is None and self.missing == MISSING_SKIP:
+                    continue
+                yield self._wrap_obj(_RelatedObject(obj.pk, instance))
     
     def __repr__(self):
        data = list(self)[:REPR_OUTPUT_SIZE + 1] # limit list after conversion because mongodb doesn't use integer indices
@@ -61,37 +700,223 @@ class MongoDBM2MQuerySet(object):
        return repr(data)
     
     def __getitem__(self, key):
-        obj = self.objects[key]
+        if isinstance(key, slice):
+            if not self._is_query():
+                # Slice the stored list, the objects are loaded when iterated
+                return self._clone(self.objects[key])
+            if self._result is None and key.step is None and (key.start or 0) >= 0 and (key.stop or 0) >= 0:
+                # Limit the query so only the slice is loaded
+                clone = self._clone()
+                clone._set_limits(key.start, key.stop)
+                return clone
+            return [self._wrap_obj(obj) for obj in _iter_objects(self.rel, self._get_objects()[key], self.missing)]
+        obj = self._get_objects()[key]
         return self._get_obj(obj)
     
     def ordered(self, *args, **kwargs):
         return self
     
+    def only(self, *field_names):
+        """
+        Return a new query set that loads only the given fields of the objects
+        that are not in memory yet.
+        """
+        clone = self._clone()
+        clone._load_fields = ('only', field_names)
+        return clone
+    
+    def defer(self, *field_names):
+        """
+        Return a new query set that doesn't load the given fields of the objects
+        that are not in memory yet.
+        """
+        clone = self._clone()
+        clone._load_fields = ('defer', field_names)
+        return clone
+    
+    def values_list(self, *field_names, **kwargs):
+        """
+        Return a list of tuples of the given field values of the related objects,
+        or a list of the values if flat=True and there's one field. The values are
+        taken from the instances in memory or the embedded values if they have them,
+        and only the requested fields of the rest are queried.
+        """
+        flat = kwargs.pop('flat', False)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments to values_list: %s' % (kwargs.keys(),))
+        if flat and len(field_names) > 1:
+            raise TypeError("'flat' is not valid when values_list is called with more than one field.")
+        model = self.rel.to
+        if not field_names:
+            field_names = [field.attname for field in model._meta.fields]
+        # Fields can also be given by attname, like main_category_id for main_category
+        attnames = dict((field.attname, field) for field in model._meta.fields)
+        # (name, field or None for the pk) of each requested value
+        fields = []
+        for name in field_names:
+            if name in ('pk', model._meta.pk.name, model._meta.pk.attname):
+                fields.append((name, None))
+            else:
+                fields.append((name, attnames.get(name) or model._meta.get_field(name)))
+        rows = []
+        unloaded = {}
+        for obj in self._get_objects():
+            values = []
+            for name, field in fields:
+                if field is None:
+                    values.append(str(obj.pk))
+                elif obj._raw is not None and field.column in obj._raw:
+                    values.append(field.to_python(obj._raw[field.column]))
+                elif obj._obj is not None and not isinstance(type(obj._obj).__dict__.get(field.attname), DeferredAttribute):
+                    values.append(getattr(obj._obj, field.attname))
+                else:
+                    # Query the values later
+                    unloaded.setdefault(obj.pk, []).append(len(rows))
+                    values = None
+                    break
+            rows.append(values)
+        if unloaded:
+            pks = unloaded.keys()
+            names = [field.name for name, field in fields if field is not None]
+            for start in xrange(0, len(pks), LOAD_CHUNK_SIZE):
+                queryset = model.objects.using(self.db).filter(pk__in=pks[start:start + LOAD_CHUNK_SIZE]).values_list('pk', *names)
+                for row in queryset:
+                    pk = ObjectId(row[0])
+                    values = iter(row[1:])
+                    row = [str(pk) if field is None else values.next() for name, field in fields]
+                    for index in unloaded.pop(pk, ()):
+                        rows[index] = row
+                if instrumentation.active:
+                    instrumentation.record_query(len(queryset), self.rel.field)
+        # Leave out the objects that don't exist
+        rows = [row for row in rows if row is not None]
+        if flat:
+            return [row[0] for row in rows]
+        return [tuple(row) for row in rows]
+    
+    def values(self, *field_names):
+        """
+        Return a list of dicts of the given field values of the related objects,
+        like values_list().
+        """
+        if not field_names:
+            field_names = [field.attname for field in self.rel.to._meta.fields]
+        return [dict(zip(field_names, row)) for row in self.values_list(*field_names)]
+    
     def __len__(self):
-        return len(self.objects)
+        return len(self._get_objects())
     
     def using(self, db, *args, **kwargs):
         self.db = db
         return self
     
     def filter(self, *args, **kwargs):
-        return self
+        """
+        Return a new query set containing the related objects that match the lookups.
+        """
+        if self.appear_as_relationship_model or not (args or kwargs):
+            # Intermediate relationship objects can't be filtered
+            return self
+        assert self._low == 0 and self._high is None, "Cannot filter a query once a slice has been taken."
+        clone = self._clone()
+        clone._filters.append((args, kwargs))
+        return clone
+    
+    def order_by(self, *field_names):
+        """
+        Return a new query set sorted by the given fields instead of the stored order.
+        """
+        assert self._low == 0 and self._high is None, "Cannot reorder a query once a slice has been taken."
+        clone = self._clone()
+        clone._ordering = field_names
+        return clone
     
     def get(self, *args, **kwargs):
         if 'pk' in kwargs:
             pk = ObjectId(kwargs['pk'])
-            for obj in self.objects:
-                if pk == obj['pk']:
+            for obj in self._get_objects():
+                if pk == obj.pk:
                     return self._get_obj(obj)
         return None
     
     def count(self):
-        return len(self.objects)
+        return len(self._get_objects())
+
+# Counted query set classes by the query set class they extend
+_counted_query_set_classes = {}
+
+def _counted_query_set(queryset, field):
+    """
+    Make a query set on the model of a reverse relation record its queries for
+    the field while instrumentation is active: when it's evaluated, counted or
+    filtered and then evaluated. Prefetched results are not counted.
+    """
+    base = queryset.__class__
+    if base not in _counted_query_set_classes:
+        class CountedQuerySet(base):
+            def iterator(self):
+                if not instrumentation.active:
+                    for obj in base.iterator(self):
+                        yield obj
+                    return
+                documents = 0
+                try:
+                    for obj in base.iterator(self):
+                        documents += 1
+                        yield obj
+                finally:
+                    instrumentation.record_query(documents, self._mongom2m_field)
+            def count(self):
+                if instrumentation.active and self._result_cache is None:
+                    instrumentation.record_query(0, self._mongom2m_field)
+                return base.count(self)
+            def _clone(self, *args, **kwargs):
+                clone = base._clone(self, *args, **kwargs)
+                clone._mongom2m_field = self._mongom2m_field
+                return clone
+        CountedQuerySet.__name__ = base.__name__
+        _counted_query_set_classes[base] = CountedQuerySet
+    queryset.__class__ = _counted_query_set_classes[base]
+    queryset._mongom2m_field = field
+    return queryset
+
+class _ReverseObjectList(object):
+    """
+    Read-only sequence of the internal objects of a reverse relation, used by the
+    emulated relationship query sets. The length is counted by MongoDB, slices
+    are loaded with skip and limit, and iterating loads the objects in batches
+    that continue from the last pk, so only the objects that are actually used
+    are loaded. Iterate it rather than slicing it to go through all of them.
+    """
+    def __init__(self, manager):
+        self.manager = manager
+        self._len = None
+    
+    def __len__(self):
+        if self._len is None:
+            self._len = self.manager.count()
+        return self._len
+    
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [_RelatedObject(ObjectId(obj.pk), obj) for obj in self.manager[key]]
+        obj = self.manager[key]
+        return _RelatedObject(ObjectId(obj.pk), obj)
+    
+    def __iter__(self):
+        return self.iterator(LOAD_CHUNK_SIZE)
+    
+    def iterator(self, chunk_size):
+        for obj in self.manager.iterator(chunk_size):
+            yield _RelatedObject(ObjectId(obj.pk), obj)
 
 class MongoDBM2MReverseManager(object):
     """
     This manager is attached to the other side of M2M relationships
     and will return query sets that fetch related objects.
+    count(), exists(), slicing and iterator() run on MongoDB, so the
+    related objects are not all loaded to answer them. After prefetch_reverse(),
+    all(), count() and exists() use the prefetched results.
     """
     def __init__(self, rel_field, model, field, rel, embed):
         self.rel_field = rel_field
@@ -100,19 +925,116 @@ class MongoDBM2MReverseManager(object):
         self.rel = rel
         self.embed = embed
     
-    def all(self):
+    def _spec(self):
         """
-        Retrieve all related objects.
+        Return the MongoDB query that matches the related objects.
         """
         name = self.field.column + '.' + self.rel.model._meta.pk.column
-        pk = ObjectId(self.rel_field.pk)
-        return self.model._default_manager.raw_query({name:pk})
+        spec = {name:ObjectId(self.rel_field.pk)}
+        if self.field.overflow_threshold is not None:
+            # Also the parents that have the object in their overflow
+            parents = self.field._overflow_parents(self.rel_field.pk)
+            if parents:
+                spec = {'$or':[spec, {'_id':{'$in':parents}}]}
+        return spec
+    
+    def _prefetched(self):
+        return getattr(self.rel_field, '_mongom2m_prefetched', {}).get(self.rel.related_name)
+    
+    def all(self):
+        """
+        Retrieve all related objects. The query set records its queries with the
+        instrumentation.
+        """
+        queryset = _counted_query_set(self.model._default_manager.raw_query(self._spec()), self.field)
+        prefetched = self._prefetched()
+        if prefetched and 'objects' in prefetched:
+            # Evaluating the query set returns the prefetched objects, filtering it queries again
+            queryset._result_cache = list(prefetched['objects'])
+        return queryset
+    
+    def count(self):
+        """
+        Count the related objects in MongoDB.
+        """
+        prefetched = self._prefetched()
+        if prefetched:
+            return prefetched['count'] if 'count' in prefetched else len(prefetched['objects'])
+        if instrumentation.active:
+            instrumentation.record_query(0, self.field)
+        return _get_collection(self.model).find(self._spec()).count()
+    
+    def exists(self):
+        """
+        Return True if there is at least one related object.
+        """
+        if self._prefetched():
+            return self.count() > 0
+        if instrumentation.active:
+            instrumentation.record_query(0, self.field)
+        return bool(list(_get_collection(self.model).find(self._spec(), fields=['_id'], limit=1)))
+    
+    def values_list(self, *field_names, **kwargs):
+        """
+        Return the given field values of the related objects, querying only those fields.
+        """
+        return self.all().values_list(*field_names, **kwargs)
+    
+    def values(self, *field_names):
+        """
+        Return dicts of the given field values of the related objects, querying only those fields.
+        """
+        return self.all().values(*field_names)
+    
+    def only(self, *field_names):
+        """
+        Return the related objects with only the given fields loaded.
+        """
+        return self.all().only(*field_names)
+    
+    def defer(self, *field_names):
+        """
+        Return the related objects without the given fields loaded.
+        """
+        return self.all().defer(*field_names)
+    
+    def __getitem__(self, key):
+        """
+        Return a slice (or one) of the related objects in pk order,
+        using skip and limit so only the slice is loaded.
+        """
+        result = self.all().order_by('pk')[key]
+        if instrumentation.active:
+            instrumentation.record_query(len(result) if isinstance(key, slice) else 1, self.field)
+        return result
+    
+    def iterator(self, chunk_size=LOAD_CHUNK_SIZE):
+        """
+        Iterate over the related objects in pk order, loading chunk_size objects
+        per query, without keeping them in memory. Each chunk continues from the
+        last pk of the previous one, so going through a large relation doesn't
+        slow down like skip would.
+        """
+        spec = self._spec()
+        last_pk = None
+        while True:
+            if last_pk is not None:
+                spec['_id'] = {'$gt':last_pk}
+            chunk = list(self.model._default_manager.raw_query(spec).order_by('pk')[:chunk_size])
+            if instrumentation.active:
+                instrumentation.record_query(len(chunk), self.field)
+            for obj in chunk:
+                yield obj
+            if len(chunk) < chunk_size:
+                break
+            last_pk = ObjectId(chunk[-1].pk)
     
     def _relationship_query_set(self, model, to_instance, model_module_name, to_module_name):
         """
         Emulate an intermediate 'through' relationship query set.
+        The objects are loaded only as far as the query set is used.
         """
-        objects = [{'pk':ObjectId(obj.pk), 'obj':obj} for obj in self.all()]
+        objects = _ReverseObjectList(self)
         return MongoDBM2MQuerySet(self.rel, self.rel.to, objects, use_cached=True, appear_as_relationship=(model, None, to_instance, model_module_name, to_module_name))
 
 class MongoDBM2MReverseDescriptor(object):
@@ -131,22 +1053,249 @@ class MongoDBM2MRelatedManager(object):
     """
     This manager manages the related objects stored in a MongoDBManyToManyField.
     They can be embedded or stored as relations (ObjectIds) only.
-    Internally, we store the objects as dicts that contain keys pk and obj.
-    The obj key is None when the object has not yet been loaded from the db.
+    Internally, we store the objects as _RelatedObjects that contain the pk and obj.
+    The obj is None when the object has not yet been loaded from the db.
+    Next to the ordered list we keep a set of the pks for fast membership tests.
+    The list and the set are shared with the query sets and manager copies
+    created from this manager, and only copied when this manager modifies them.
+    
+    Values loaded from the database are decoded lazily: count(), ids() and
+    membership tests use the raw list, the internal objects list is created
+    on first access and embedded instances are created one by one when used.
+    
+    Changes made with add(), remove() and clear() are also tracked as pending
+    changes, which commit() persists as atomic updates of the parent document.
+    Saving the model instance writes the whole list and discards them.
+    
+    If the field has an overflow_threshold, the objects beyond it are stored in
+    the field's overflow collection. They are loaded in chunks when the whole
+    list is first needed, while count(), membership tests, add() and remove()
+    query them. Objects added before the overflow is loaded go after it, and
+    saving or committing writes them to the overflow collection.
     """
     def __init__(self, field, rel, embed, objects=[], model_instance=None):
         self.model_instance = model_instance
         self.field = field
         self.rel = rel
         self.embed = embed
-        self.objects = list(objects) # make copy of the list to avoid problems
+        # Whether the parent has objects in the overflow collection, and whether they're not in the list yet
+        self._overflow_stored = False
+        self._overflow_unloaded = False
+        # Overflow values to write when the parent has been saved, None to leave the collection alone
+        self._overflow_pending = None
+        # (removed pks, added values) to write to an overflow that wasn't loaded, when the parent has been saved
+        self._overflow_delta = None
+        self._overflow_owner = model_instance
+        self._set_objects(list(objects)) # make copy of the list to avoid problems
+        self._reset_pending()
+    
+    def _reset_pending(self):
+        """
+        Forget the pending changes, e.g. after the whole list has been saved.
+        """
+        self._pending_add = []
+        self._pending_remove = set()
+        self._pending_clear = False
+    
+    def _set_objects(self, objects):
+        """
+        Replace the internal objects list and rebuild the pk index.
+        """
+        self._raw_values = None
+        self._objects = objects
+        self._pk_index = set(obj.pk for obj in objects)
+        self._shared = False
+        self._overflow_unloaded = False
+        # Objects added after the overflow and pks removed from it while it's not loaded
+        self._overflow_added = []
+        self._overflow_removed = set()
+    
+    def _get_inline_objects(self):
+        if self._objects is None:
+            # Create the internal objects from the raw database values on first access
+            self._objects = [self._raw_to_object(value) for value in self._raw_values]
+            self._raw_values = None
+        return self._objects
+    
+    def _get_objects(self):
+        objects = self._get_inline_objects()
+        if self._overflow_unloaded:
+            self._load_overflow()
+            objects = self._objects
+        return objects
+    
+    def _overflow_spec(self):
+        owner = self._overflow_owner or self.model_instance
+        if owner is None or owner.pk is None:
+            raise ValueError('Cannot load the overflow of a relation that is not connected to a model instance')
+        return {'parent':ObjectId(owner.pk)}
+    
+    def _iter_overflow(self, chunk_size=LOAD_CHUNK_SIZE):
+        """
+        Yield internal objects for the rows of the overflow collection in stored
+        order, chunk_size rows per query, leaving out the ones removed since.
+        """
+        collection = self.field.overflow_collection()
+        spec = self._overflow_spec()
+        position = -1
+        while True:
+            spec['position'] = {'$gt':position}
+            rows = list(collection.find(spec).sort('position', 1).limit(chunk_size))
+            if instrumentation.active:
+                instrumentation.record_query(len(rows), self.field)
+            for row in rows:
+                if row['related'] not in self._overflow_removed:
+                    yield self._raw_to_object(row['value'])
+            if len(rows) < chunk_size:
+                break
+            position = rows[-1]['position']
+    
+    def _iter_unloaded(self, chunk_size=LOAD_CHUNK_SIZE):
+        """
+        Yield the internal objects of a relation whose overflow isn't loaded, in
+        stored order, without keeping the overflow: the stored list, the overflow
+        one page at a time and then the objects added since.
+        """
+        for obj in self._get_inline_objects():
+            yield obj
+        for obj in self._iter_overflow(chunk_size):
+            yield obj
+        for obj in list(self._overflow_added):
+            yield obj
+    
+    def _load_overflow(self):
+        """
+        Append the objects stored in the overflow collection to the internal
+        objects list, LOAD_CHUNK_SIZE objects per query in stored order.
+        """
+        self._unshare_objects()
+        for obj in self._iter_overflow():
+            self._objects.append(obj)
+            if self._pk_index is not None:
+                self._pk_index.add(obj.pk)
+        # The objects added in the meantime go after the overflow, and are already in the pk index
+        self._objects.extend(self._overflow_added)
+        self._overflow_added = []
+        self._overflow_removed = set()
+        self._overflow_unloaded = False
+    
+    def _replace_objects(self, objects):
+        self._raw_values = None
+        self._objects = objects
+        self._shared = False
+    
+    objects = property(_get_objects, _replace_objects)
+    
+    def _share_objects(self):
+        """
+        Return the objects list for sharing with a query set or manager copy.
+        """
+        self._shared = True
+        return self.objects
+    
+    def _unshare_objects(self):
+        """
+        Copy the shared objects list and pk index before modifying them in place.
+        """
+        if self._shared:
+            self._objects = list(self._get_inline_objects())
+            self._pk_index = set(self._pks)
+            self._shared = False
+    
+    @property
+    def _pks(self):
+        """
+        The set of the related pks. While the overflow isn't loaded, it only has the
+        ones in the stored list and the ones added since, see _members().
+        """
+        if self._pk_index is None:
+            if self._overflow_unloaded:
+                self._pk_index = set(obj.pk for obj in self._get_inline_objects())
+                self._pk_index.update(obj.pk for obj in self._overflow_added)
+            else:
+                self._pk_index = set(self.ids())
+        return self._pk_index
+    
+    def _members(self, pks):
+        """
+        Return the set of the given ObjectIds that are in the relation. While the
+        overflow isn't loaded, the ones that aren't in the pk index are looked up
+        in the overflow collection with one indexed query instead of loading it.
+        """
+        pk_index = self._pks
+        found = set(pk for pk in pks if pk in pk_index)
+        if self._overflow_unloaded:
+            rest = [pk for pk in pks if pk not in found and pk not in self._overflow_removed]
+            if rest:
+                spec = self._overflow_spec()
+                spec['related'] = {'$in':rest}
+                found.update(row['related'] for row in self.field.overflow_collection().find(spec, fields=['related']))
+        return found
+    
+    def _all_pks(self):
+        """
+        Return the set of all the related pks. The pks in an overflow that isn't
+        loaded are queried without loading the objects.
+        """
+        if not self._overflow_unloaded:
+            return self._pks
+        pks = set(self._pks)
+        rows = self.field.overflow_collection().find(self._overflow_spec(), fields=['related'])
+        pks.update(row['related'] for row in rows if row['related'] not in self._overflow_removed)
+        return pks
+    
+    def _raw_pk(self, value):
+        """
+        Get the ObjectId of a raw database value without decoding it.
+        """
+        if isinstance(value, ObjectId):
+            return value
+        elif isinstance(value, basestring):
+            return ObjectId(value)
+        elif isinstance(value, dict):
+            pk = value[self.rel.to._meta.pk.column]
+            return pk if isinstance(pk, ObjectId) else ObjectId(pk)
+        else:
+            return ObjectId(value.pk)
+    
+    def _raw_to_object(self, value):
+        """
+        Convert a raw database value to an internal object, postponing the
+        creation of the model instance for embedded values.
+        """
+        if self.embed and isinstance(value, dict) and len(value) > 1:
+            return _RelatedObject(self._raw_pk(value), raw=value, codec=self.field.codec)
+        elif isinstance(value, models.Model):
+            return self.to_python_embedded_instance(value)
+        return _RelatedObject(self._raw_pk(value))
     
     def _with_model_instance(self, model_instance):
         """
         Create a new copy of this manager for a specific model instance. This
         is called when the field is being accessed through a model instance.
         """
-        return MongoDBM2MRelatedManager(self.field, self.rel, self.embed, self.objects, model_instance=model_instance)
+        manager = MongoDBM2MRelatedManager(self.field, self.rel, self.embed, model_instance=model_instance)
+        if self._objects is None:
+            # Not decoded yet, share the raw values
+            manager._raw_values = self._raw_values
+            manager._objects = None
+            manager._pk_index = None
+        else:
+            # Share the objects decoded so far, without loading the overflow
+            manager._objects = self._get_inline_objects()
+            manager._pk_index = self._pks
+            manager._shared = self._shared = True
+        manager._pending_add = list(self._pending_add)
+        manager._pending_remove = set(self._pending_remove)
+        manager._pending_clear = self._pending_clear
+        manager._overflow_stored = self._overflow_stored
+        manager._overflow_unloaded = self._overflow_unloaded
+        manager._overflow_pending = self._overflow_pending
+        manager._overflow_delta = self._overflow_delta
+        manager._overflow_added = list(self._overflow_added)
+        manager._overflow_removed = set(self._overflow_removed)
+        manager._overflow_owner = self._overflow_owner or model_instance
+        return manager
     
     def __call__(self):
         """
@@ -155,7 +1304,14 @@ class MongoDBM2MRelatedManager(object):
         return MongoDBM2MRelatedManager(self.field, self.rel, self.embed, self.objects)
     
     def count(self):
-        return len(self.objects)
+        if self._overflow_unloaded:
+            # Count the overflow without loading it
+            inline = len(self._raw_values) if self._objects is None else len(self._objects)
+            stored = self.field.overflow_collection().find(self._overflow_spec()).count()
+            return inline + stored - len(self._overflow_removed) + len(self._overflow_added)
+        if self._objects is None:
+            return len(self._raw_values)
+        return len(self._objects)
     
     def add(self, *objs):
         """
@@ -164,6 +1320,7 @@ class MongoDBM2MRelatedManager(object):
         """
         using = 'default' # should see if we can carry this over from somewhere
         add_objs = []
+        add_pks = set()
         for obj in objs:
             if isinstance(obj, (ObjectId, basestring)):
                 # It's an ObjectId
@@ -173,18 +1330,29 @@ class MongoDBM2MRelatedManager(object):
                 # It's a model object
                 pk = ObjectId(obj.pk)
                 instance = obj
-            if not pk in (obj['pk'] for obj in self.objects):
-                add_objs.append({'pk':pk, 'obj':instance})
+            if pk not in add_pks:
+                add_pks.add(pk)
+                add_objs.append(_RelatedObject(pk, instance))
+        existing = self._members(add_pks)
+        if existing:
+            add_objs = [obj for obj in add_objs if obj.pk not in existing]
+            add_pks -= existing
         
         # Calculate list of object ids that are being added
-        add_obj_ids = [str(obj['pk']) for obj in add_objs]
+        add_obj_ids = [str(obj.pk) for obj in add_objs]
         
         # Send pre_add signal (instance should be Through instance but it's the manager instance for now)
         m2m_changed.send(self.rel.through, instance=self.model_instance, action='pre_add', reverse=False, model=self.rel.to, pk_set=add_obj_ids, using=using)
         
         # Commit the add
-        for obj in add_objs:
-            self.objects.append({'pk':obj['pk'], 'obj':obj['obj']})
+        self._unshare_objects()
+        if self._overflow_unloaded:
+            # They go after the overflow, which is not loaded
+            self._overflow_added.extend(add_objs)
+        else:
+            self.objects.extend(add_objs)
+        self._pks.update(add_pks)
+        self._pending_add.extend(add_objs)
         
         # Send post_add signal (instance should be Through instance but it's the manager instance for now)
         m2m_changed.send(self.rel.through, instance=self.model_instance, action='post_add', reverse=False, model=self.rel.to, pk_set=add_obj_ids, using=using)
@@ -206,16 +1374,33 @@ class MongoDBM2MRelatedManager(object):
         a string representing an ObjectId. The related object is
         not deleted, it's only removed from the list.
         """
-        obj_ids = set([ObjectId(obj) if isinstance(obj, (ObjectId, basestring)) else ObjectId(obj.pk) for obj in objs])
+        obj_ids = self._members(set([ObjectId(obj) if isinstance(obj, (ObjectId, basestring)) else ObjectId(obj.pk) for obj in objs]))
         
         # Calculate list of object ids that will be removed
-        removed_obj_ids = [str(obj['pk']) for obj in self.objects if obj['pk'] in obj_ids]
+        removed_obj_ids = [str(pk) for pk in obj_ids]
         
         # Send the pre_remove signal
         m2m_changed.send(self.rel.through, instance=self.model_instance, action='pre_remove', reverse=False, model=self.rel.to, pk_set=removed_obj_ids)
         
-        # Commit the remove
-        self.objects = [obj for obj in self.objects if obj['pk'] not in obj_ids]
+        # Commit the remove, rebuilding the list only once for all the removed objects.
+        # The rebuilt list is a new one, so a shared list doesn't have to be copied first.
+        if obj_ids:
+            if self._overflow_unloaded:
+                # The ones in the overflow are skipped when it's loaded
+                objects = self._get_inline_objects()
+                kept = set(obj.pk for obj in objects) | set(obj.pk for obj in self._overflow_added)
+                self._overflow_removed |= obj_ids - kept
+                self._overflow_added = [obj for obj in self._overflow_added if obj.pk not in obj_ids]
+                objects = [obj for obj in objects if obj.pk not in obj_ids]
+            else:
+                objects = [obj for obj in self.objects if obj.pk not in obj_ids]
+            if self._shared:
+                self._pk_index = self._pks - obj_ids
+            else:
+                self._pks.difference_update(obj_ids)
+            self.objects = objects
+            self._pending_add = [obj for obj in self._pending_add if obj.pk not in obj_ids]
+            self._pending_remove |= obj_ids
         
         # Send the post_remove signal
         m2m_changed.send(self.rel.through, instance=self.model_instance, action='post_remove', reverse=False, model=self.rel.to, pk_set=removed_obj_ids)
@@ -228,36 +1413,115 @@ class MongoDBM2MRelatedManager(object):
         deleted from the database.
         """
         # Calculate list of object ids that will be removed
-        removed_obj_ids = [str(obj['pk']) for obj in self.objects]
+        removed_obj_ids = [str(obj.pk) for obj in self.objects]
         
         # Send the pre_clear signal
         m2m_changed.send(self.rel.through, instance=self.model_instance, action='pre_clear', reverse=False, model=self.rel.to, pk_set=removed_obj_ids)
         
         # Commit the clear
-        self.objects = []
+        self._set_objects([])
+        self._reset_pending()
+        self._pending_clear = True
         
         # Send the post_clear signal
         m2m_changed.send(self.rel.through, instance=self.model_instance, action='post_clear', reverse=False, model=self.rel.to, pk_set=removed_obj_ids)
         
         return self
     
+    def set(self, objs):
+        """
+        Replace the related objects with the given model instances or ObjectIds.
+        Only the difference to the current objects is removed and added, so
+        m2m_changed is sent only for it, and the unchanged objects keep their
+        loaded or embedded instances. Like add() and remove(), the change is
+        persisted by commit() or by saving the model instance.
+        """
+        current_pks = self._all_pks()
+        new_pks = set()
+        add_objs = []
+        for obj in objs:
+            pk = ObjectId(obj) if isinstance(obj, (ObjectId, basestring)) else ObjectId(obj.pk)
+            if pk not in new_pks:
+                new_pks.add(pk)
+                if pk not in current_pks:
+                    add_objs.append(obj)
+        remove_pks = current_pks - new_pks
+        if remove_pks:
+            self.remove(*remove_pks)
+        if add_objs:
+            self.add(*add_objs)
+        return self
+    
+    def commit(self):
+        """
+        Persist the pending changes made with add(), remove() and clear() to
+        the database without rewriting the whole list. Removed objects are
+        $pull'ed and added objects $push'ed by updates that only match if the
+        document doesn't contain them yet, so concurrent commits to the same
+        relation don't overwrite each other or add duplicates. If the model
+        instance hasn't been saved yet, it's saved as a whole instead.
+        """
+        if self.model_instance is None:
+            raise ValueError('Cannot commit a relation that is not connected to a model instance')
+        if self.model_instance.pk is None:
+            self.model_instance.save()
+            return self
+        collection = _get_collection(self.model_instance.__class__)
+        spec = {'_id':ObjectId(self.model_instance.pk)}
+        column = self.field.column
+        count_column = self.field.count_column
+        if self._pending_clear:
+            update = {'$set':{column:[]}}
+            if count_column:
+                update['$set'][count_column] = 0
+            collection.update(spec, update)
+            if self._overflow_stored:
+                self.field.overflow_collection().remove({'parent':spec['_id']})
+                self._overflow_stored = False
+        elif self._pending_remove:
+            remove_pks = list(self._pending_remove)
+            self.field._pull(spec, remove_pks)
+            if self._overflow_stored:
+                self.field._remove_overflow({'parent':spec['_id'], 'related':{'$in':remove_pks}})
+        if self._pending_add:
+            if self.field._push([spec['_id']], self._get_db_prep_values(self._pending_add)):
+                self._overflow_stored = True
+        if self._overflow_unloaded:
+            # The changes to the overflow that isn't loaded have been written
+            self._overflow_added = []
+            self._overflow_removed = set()
+        if count_column:
+            setattr(self.model_instance, self.field.count_field, self.count())
+        self._reset_pending()
+        return self
+    
     def __contains__(self, obj):
         """
         Helper to enable 'object in container' by comparing IDs.
         """
         if hasattr(obj, 'pk'): obj = obj.pk
         elif hasattr(obj, 'id'): obj = obj.id
-        return ObjectId(obj) in [ObjectId(o['pk']) for o in self.objects]
+        return bool(self._members([ObjectId(obj)]))
     
     def __iter__(self):
         """
         Iterator is used by Django admin's ModelMultipleChoiceField.
+        Unloaded objects are loaded in chunks and kept in memory.
+        """
+        for obj in _iter_objects(self.rel, self.objects):
+            yield obj.obj
+    
+    def iterator(self, chunk_size=LOAD_CHUNK_SIZE, missing=MISSING_RAISE):
         """
-        for obj in self.objects:
-            if not obj['obj']:
-                # Load referred instance from db and keep in memory
-                obj['obj'] = self.rel.to.objects.get(pk=obj['pk'])
-            yield obj['obj']
+        Iterate over the related objects without keeping the loaded instances,
+        for going through huge relations. See MongoDBM2MQuerySet.iterator().
+        An overflow that isn't loaded is read page by page and not kept either.
+        """
+        if self._overflow_unloaded:
+            objects = self._iter_unloaded(chunk_size)
+        else:
+            objects = self._share_objects()
+        return MongoDBM2MQuerySet(self.rel, self.rel.to, objects, use_cached=True, missing=missing).iterator(chunk_size)
     
     def all(self, **kwargs):
         """
@@ -265,21 +1529,25 @@ class MongoDBM2MRelatedManager(object):
         is enabled, returns embedded objects. Otherwise the query set
         will retrieve the objects from the database as needed.
         """
-        return MongoDBM2MQuerySet(self.rel, self.rel.to, self.objects, use_cached=True, **kwargs)
+        return MongoDBM2MQuerySet(self.rel, self.rel.to, self._share_objects(), use_cached=True, **kwargs)
     
     def ids(self):
         """
         Return a list of ObjectIds of all the related objects.
         """
-        return [obj['pk'] for obj in self.objects]
+        if self._overflow_unloaded:
+            return [obj.pk for obj in self.objects]
+        if self._objects is None:
+            return [self._raw_pk(value) for value in self._raw_values]
+        return [obj.pk for obj in self._objects]
     
-    def objs(self):
+    def objs(self, missing=MISSING_RAISE):
         """
         Return the actual related model objects, loaded fresh from
         the database. This won't use embedded objects even if they
         exist.
         """
-        return MongoDBM2MQuerySet(self.rel, self.rel.to, self.objects, use_cached=False)
+        return MongoDBM2MQuerySet(self.rel, self.rel.to, self._share_objects(), use_cached=False, missing=missing)
     
     def to_python_embedded_instance(self, embedded_instance):
         """
@@ -288,82 +1556,139 @@ class MongoDBM2MRelatedManager(object):
         """
         if isinstance(embedded_instance, ObjectId):
             # It's an object id, probably from a ListField(ForeignKey) migration
-            return {'pk':embedded_instance, 'obj':None}
+            return _RelatedObject(embedded_instance)
         elif isinstance(embedded_instance, basestring):
             # Assume it's a string formatted object id, probably from a ListField(ForeignKey) migration
-            return {'pk':ObjectId(embedded_instance), 'obj':None}
+            return _RelatedObject(ObjectId(embedded_instance))
         elif self.embed:
             # Try to load the embedded object contents if possible
             if isinstance(embedded_instance, dict):
                 # Convert the embedded value from dict to model
-                data = {}
-                for field in self.rel.to._meta.fields:
-                    try:
-                        data[str(field.attname)] = embedded_instance[field.column]
-                    except KeyError:
-                        pass
-                # If we only got the id, give up to avoid creating an invalid/empty model instance
-                if len(data) <= 1:
-                    return {'pk':ObjectId(embedded_instance[self.rel.to._meta.pk.column]), 'obj':None}
-                # Otherwise create the model instance from the fields
-                obj = self.rel.to(**data)
-                # Make sure the pk in the model instance is a string (not ObjectId) to be compatible with django-mongodb-engine
-                if isinstance(obj.pk, ObjectId):
-                    obj.pk = str(obj.pk)
-                return {'pk':ObjectId(obj.pk), 'obj':obj}
+                obj = self.field.codec.decode(embedded_instance)
+                if obj is None:
+                    return _RelatedObject(ObjectId(embedded_instance[self.rel.to._meta.pk.column]))
+                return _RelatedObject(ObjectId(obj.pk), obj)
             else:
                 # Assume it's already a model
                 obj = embedded_instance
                 # Make sure the pk is a string (not ObjectId) to be compatible with django-mongodb-engine
                 if isinstance(obj.pk, ObjectId):
                     obj.pk = str(obj.pk)
-                return {'pk':ObjectId(obj.pk), 'obj':obj}
+                return _RelatedObject(ObjectId(obj.pk), obj)
         else:
             # No embedded value, only ObjectId
             if isinstance(embedded_instance, dict):
                 # Get the id value from the dict
-                return {'pk':ObjectId(embedded_instance[self.rel.to._meta.pk.column]), 'obj':None}
+                return _RelatedObject(ObjectId(embedded_instance[self.rel.to._meta.pk.column]))
             else:
                 # Assume it's already a model
-                return {'pk':ObjectId(embedded_instance.pk), 'obj':None}
+                return _RelatedObject(ObjectId(embedded_instance.pk))
     
     def to_python(self, values):
         """
         Convert a database value to Django model instances managed by this manager.
+        The values are only decoded when they are accessed.
         """
         if isinstance(values, models.Model):
             # Single value given as parameter
             values = [values]
-        self.objects = [self.to_python_embedded_instance(value) for value in values]
+        self._raw_values = [value for value in values if not (isinstance(value, dict) and OVERFLOW_KEY in value)]
+        self._objects = None
+        self._pk_index = None
+        self._shared = False
+        # The overflow marker means that the rest of the objects are in the overflow collection
+        self._overflow_stored = self._overflow_unloaded = len(self._raw_values) < len(values)
+        self._overflow_pending = None
+        self._overflow_delta = None
+        self._overflow_added = []
+        self._overflow_removed = set()
     
     def get_db_prep_value_embedded_instance(self, obj):
         """
         Convert an internal object value to database representation.
         """
         if not obj: return None
-        pk = obj['pk']
+        pk = obj.pk
         if not self.embed:
             # Store only the ID
             return { self.rel.to._meta.pk.column:pk }
-        if not obj['obj']:
+        if not obj.obj:
             # Retrieve the object from db for storing as embedded data
-            obj['obj'] = self.rel.to.objects.get(pk=pk)
-        embedded_instance = obj['obj']
-        values = {}
-        for field in embedded_instance._meta.fields:
-            value = field.pre_save(embedded_instance, add=True)
-            value = field.get_db_prep_value(value)
-            values[field.column] = value
-        # Convert primary key into an ObjectId so it's stored correctly
-        values[self.rel.to._meta.pk.column] = ObjectId(values[self.rel.to._meta.pk.column])
-        return values
+            obj.obj = _fetch_related_object(self.rel.field, pk)
+        return self.field.codec.encode(obj.obj)
+    
+    def _get_db_prep_values(self, objects):
+        """
+        Convert a list of internal objects to database representation. When embedding,
+        the objects that aren't in memory are first loaded with one query per chunk.
+        """
+        if not self.embed:
+            # Store only the IDs
+            pk_column = self.rel.to._meta.pk.column
+            return [{pk_column:obj.pk} for obj in objects]
+        unloaded = [obj for obj in objects if not obj.obj]
+        if unloaded:
+            _load_objects(self.rel, unloaded, MISSING_NONE)
+            missing_pks = [str(obj.pk) for obj in unloaded if not obj.obj]
+            if missing_pks:
+                raise self.rel.to.DoesNotExist('%s matching ids %s do not exist' % (self.rel.to._meta.object_name, ', '.join(missing_pks)))
+        encode = self.field.codec.encode
+        return [encode(obj.obj) for obj in objects]
     
     def get_db_prep_value(self):
         """
         Convert the Django model instances managed by this manager into a special list
-        that can be stored in MongoDB.
+        that can be stored in MongoDB. If the field has an overflow_threshold and there
+        are more objects, only that many are returned, followed by the overflow marker.
+        The rest are written to the overflow collection when the model instance is saved.
+        """
+        threshold = self.field.overflow_threshold
+        if self._overflow_unloaded and len(self._get_inline_objects()) < threshold and self.count() <= threshold:
+            # Everything fits in the document again, the few objects left in the overflow are moved there
+            self._load_overflow()
+        if self._overflow_unloaded:
+            # Only the objects added and removed since the document was loaded are written to the overflow
+            self._overflow_pending = None
+            self._overflow_delta = None
+            if self._overflow_added or self._overflow_removed:
+                self._overflow_delta = (list(self._overflow_removed), self._get_db_prep_values(self._overflow_added))
+            return self._get_db_prep_values(self._get_inline_objects()) + [{OVERFLOW_KEY:True}]
+        self._overflow_delta = None
+        objects = self.objects
+        if threshold is not None and len(objects) > threshold:
+            self._overflow_pending = self._get_db_prep_values(objects[threshold:])
+            return self._get_db_prep_values(objects[:threshold]) + [{OVERFLOW_KEY:True}]
+        # Remove the objects that were in the overflow collection
+        self._overflow_pending = [] if self._overflow_stored else None
+        return self._get_db_prep_values(objects)
+    
+    def _save_overflow(self, parent_pk):
+        """
+        Replace the objects in the overflow collection with the ones prepared by
+        get_db_prep_value(), after the model instance has been saved. If the overflow
+        wasn't loaded, only the objects added and removed since are written.
         """
-        return [self.get_db_prep_value_embedded_instance(obj) for obj in self.objects]
+        if self._overflow_delta is not None:
+            removed, values = self._overflow_delta
+            parent = ObjectId(parent_pk)
+            if removed:
+                self.field.overflow_collection().remove({'parent':parent, 'related':{'$in':removed}})
+            if values:
+                self.field._append_overflow({parent:values})
+            self._overflow_delta = None
+            self._overflow_added = []
+            self._overflow_removed = set()
+        if self._overflow_pending is None:
+            return
+        collection = self.field.overflow_collection()
+        parent = ObjectId(parent_pk)
+        collection.remove({'parent':parent})
+        pk_column = self.rel.to._meta.pk.column
+        rows = [{'parent':parent, 'related':value[pk_column], 'position':position, 'value':value} for position, value in enumerate(self._overflow_pending)]
+        for start in xrange(0, len(rows), LOAD_CHUNK_SIZE):
+            collection.insert(rows[start:start + LOAD_CHUNK_SIZE])
+        self._overflow_stored = bool(rows)
+        self._overflow_pending = None
 
 def create_through(field, model, to):
     """
@@ -398,8 +1723,47 @@ def create_through(field, model, to):
                 queryset = self.reverse_manager._relationship_query_set(self.model, self.to_instance, model_module_name, to_module_name).using(self.db)
                 return queryset
             return self
+        def _relationship(self, model_instance, to_instance, direction='f'):
+            # Wrap the two ends in a relationship instance with a magic key
+            if direction == 'r':
+                pk = str(to_instance.pk) + '$r$' + str(model_instance.pk)
+            else:
+                pk = str(model_instance.pk) + '$f$' + str(to_instance.pk)
+            return self.model(**{'pk':pk, model_module_name:model_instance, to_module_name:to_instance})
+        def _unwind(self):
+            # Pipeline stages that unwind the stored lists into one {_id, to} row per related object,
+            # taking the pk of embedded objects or the bare ObjectId of migrated ListField(ForeignKey) data
+            pk_path = field.column + '.' + to._meta.pk.column
+            return [{'$unwind':'$' + field.column}, {'$match':{field.column + '.' + OVERFLOW_KEY:{'$exists':False}}},
+                    {'$project':{'_id':1, 'to':{'$ifNull':['$' + pk_path, '$' + field.column]}}}]
+        def _inline_len(self):
+            for row in _aggregate(_get_collection(model), self._unwind() + [{'$group':{'_id':None, 'count':{'$sum':1}}}]):
+                return row['count']
+            return 0
+        def _relationships(self, low=0, high=None):
+            # Load a slice of all the relationships: the ones unwound from the stored lists in parent pk order,
+            # then the ones in the overflow collection in parent pk and position order
+            pipeline = [{'$sort':{'_id':1}}] + self._unwind()
+            if low:
+                pipeline.append({'$skip':low})
+            if high is not None:
+                pipeline.append({'$limit':high - low})
+            pairs = [(row['_id'], ObjectId(row['to'])) for row in _aggregate(_get_collection(model), pipeline)]
+            if field.overflow_threshold is not None and (high is None or len(pairs) < high - low):
+                # The stored lists ran out within the slice
+                skip = max(low - self._inline_len(), 0) if not pairs else 0
+                cursor = field.overflow_collection().find({}, fields=['parent', 'related']).sort([('parent', 1), ('position', 1)]).skip(skip)
+                if high is not None:
+                    cursor = cursor.limit(high - low - len(pairs))
+                pairs.extend((row['parent'], row['related']) for row in cursor)
+            model_instances = _fetch_objects(model, list(set(model_id for model_id, to_id in pairs)))
+            to_instances = _fetch_related_objects(field, list(set(to_id for model_id, to_id in pairs)))
+            return [self._relationship(model_instances[model_id], to_instances[to_id]) for model_id, to_id in pairs if model_id in model_instances and to_id in to_instances]
         def exists(self, *args, **kwargs):
-            return False
+            # Any parent with a related object in its list or overflow
+            if _aggregate(_get_collection(model), self._unwind() + [{'$limit':1}]):
+                return True
+            return field.overflow_threshold is not None and bool(list(field.overflow_collection().find({}, fields=['_id'], limit=1)))
         def ordered(self, *args, **kwargs):
             return self
         def using(self, db, *args, **kwargs):
@@ -412,26 +1776,36 @@ def create_through(field, model, to):
                 if direction == 'r':
                     # It's a reverse magic key
                     to_id, model_id = model_id, to_id
-                if direction == 'r':
-                    # Query in reverse
-                    self.to_instance = self.to.objects.get(pk=to_id)
-                    self.reverse_manager = getattr(self.to_instance, field.rel.related_name)
-                    queryset = self.reverse_manager._relationship_query_set(self.model, self.to_instance, model_module_name, to_module_name).using(self.db)
-                    obj = queryset.get(pk=model_id)
-                    return obj
-                else:
-                    self.model_instance = model.objects.get(pk=model_id)
-                    self.related_manager = getattr(self.model_instance, field.name)
-                    queryset = self.related_manager.all(appear_as_relationship=(self.model, self.model_instance, None, model_module_name, to_module_name)).using(self.db)
-                    return queryset.get(pk=to_id)
+                # Load the parent only if it refers to the related object, with a single query
+                to_id = ObjectId(to_id)
+                spec = {'_id':ObjectId(model_id), '$or':[{field.column + '.' + to._meta.pk.column:to_id}, {field.column:{'$in':[to_id, str(to_id)]}}]}
+                model_instances = list(model._default_manager.raw_query(spec))
+                if not model_instances and field.overflow_threshold is not None:
+                    # The related object may be in the parent's overflow
+                    if list(field.overflow_collection().find({'parent':ObjectId(model_id), 'related':ObjectId(to_id)}, fields=['_id'], limit=1)):
+                        model_instances = list(model._default_manager.raw_query({'_id':ObjectId(model_id)}))
+                if not model_instances:
+                    raise self.model.DoesNotExist('%s matching key %s does not exist' % (self.model._meta.object_name, kwargs['pk']))
+                to_instance = _fetch_related_object(field, to_id)
+                return self._relationship(model_instances[0], to_instance, direction)
             # Normal key
             return None
         def __len__(self):
-            # Won't work, must be accessed through filter()
-            raise Exception('ThroughQuerySet relation unknown (__len__)')
+            # Total length of the stored lists and the overflow
+            if field.overflow_threshold is not None:
+                return self._inline_len() + field.overflow_collection().find().count()
+            return self._inline_len()
         def __getitem__(self, key):
-            # Won't work, must be accessed through filter()
-            raise Exception('ThroughQuerySet relation unknown (__getitem__)')
+            if isinstance(key, slice):
+                if key.step is None and (key.start or 0) >= 0 and (key.stop or 0) >= 0:
+                    return self._relationships(key.start or 0, key.stop)
+                return self._relationships()[key]
+            if key < 0:
+                return self._relationships()[key]
+            result = self._relationships(key, key + 1)
+            if not result:
+                raise IndexError('relationship index out of range')
+            return result[0]
     class ThroughManager(MongoDBManager):
         def get_query_set(self):
             return ThroughQuerySet(self.model)
@@ -448,13 +1822,13 @@ def create_through(field, model, to):
             obj = getattr(self, model_module_name)
             manager = getattr(obj, field.name)
             manager.add(getattr(self, to_module_name))
-            obj.save() # must save parent model because Django admin won't
+            manager.commit() # must persist the change because Django admin won't save the parent
         def delete(self, *args, **kwargs):
             # Don't actually delete the model, convert to a delete() call instead
             obj = getattr(self, model_module_name)
             manager = getattr(obj, field.name)
             manager.remove(getattr(self, to_module_name))
-            obj.save() # must save parent model because Django admin won't
+            manager.commit() # must persist the change because Django admin won't save the parent
     # Remove old model from Django's model registry, because it would be a duplicate
     from django.db.models.loading import cache
     model_dict = cache.app_models.get(Through._meta.app_label)
@@ -501,12 +1875,135 @@ class MongoDBManyToManyRelationDescriptor(object):
         else:
             return type.__dict__[self.field.name]
     
+    def counts(self, match=None, fields=()):
+        """
+        Count how many model instances refer to each related object, with a single
+        aggregation that unwinds the stored relation lists, so the model instances
+        are not loaded. Returns a dict that maps the related pks to the counts.
+        match is an optional raw MongoDB query that limits the counted instances.
+        
+        If field names are given, the dict values are dicts that contain the count
+        and those fields of the related objects. They are taken from the embedded
+        copies if possible, and otherwise loaded from the related collection.
+        
+        For example, to count the articles per tag, and to get the tag names too:
+        
+        TestArticle.tags.counts()
+        TestArticle.tags.counts({'title':{'$regex':'^news'}}, fields=['name'])
+        """
+        field = self.field
+        to = field.rel.to
+        fields = [to._meta.get_field(name) for name in fields]
+        embedded = bool(field.rel.embed) and all(f in (field.embed_fields or to._meta.fields) for f in fields)
+        # Bare ObjectIds of migrated ListField(ForeignKey) data are their own pk
+        group = {'_id':{'$ifNull':['$' + field.column + '.' + to._meta.pk.column, '$' + field.column]}, 'count':{'$sum':1}}
+        if embedded:
+            for f in fields:
+                group[f.column] = {'$first':'$' + field.column + '.' + f.column}
+        pipeline = [{'$unwind':'$' + field.column}, {'$match':{field.column + '.' + OVERFLOW_KEY:{'$exists':False}}}, {'$group':group}]
+        if match:
+            pipeline.insert(0, {'$match':match})
+        rows = _aggregate(_get_collection(field.rel.model), pipeline)
+        if field.overflow_threshold is not None:
+            # Count the objects in the overflow collection too
+            group = {'_id':'$related', 'count':{'$sum':1}}
+            if embedded:
+                for f in fields:
+                    group[f.column] = {'$first':'$value.' + f.column}
+            pipeline = [{'$group':group}]
+            if match:
+                parents = [doc['_id'] for doc in _get_collection(field.rel.model).find(match, fields=['_id'])]
+                pipeline.insert(0, {'$match':{'parent':{'$in':parents}}})
+            rows += _aggregate(field.overflow_collection(), pipeline)
+        counts = {}
+        # Related objects whose fields have to be loaded
+        unloaded = set()
+        for row in rows:
+            key = str(row['_id'])
+            if key in counts:
+                counts[key]['count'] += row['count']
+                continue
+            values = counts[key] = {'count':row['count']}
+            for f in fields:
+                values[f.name] = f.to_python(row[f.column]) if embedded and row.get(f.column) is not None else None
+            if fields and (not embedded or all(row.get(f.column) is None for f in fields)):
+                # Not embedded, or a bare ObjectId without embedded values
+                unloaded.add(key)
+        if not fields:
+            return dict((pk, values['count']) for pk, values in counts.items())
+        if unloaded:
+            pks = [ObjectId(pk) for pk in unloaded]
+            for start in xrange(0, len(pks), LOAD_CHUNK_SIZE):
+                for pk, obj in _fetch_related_objects(field, pks[start:start + LOAD_CHUNK_SIZE]).items():
+                    values = counts[str(pk)]
+                    for f in fields:
+                        values[f.name] = getattr(obj, f.attname)
+        return counts
+    
+    def _parent_pks(self, parents):
+        # Model instances, ObjectIds or a query set of the model, whose ids are loaded
+        if isinstance(parents, models.query.QuerySet):
+            parents = parents.values_list('pk', flat=True)
+        return [ObjectId(obj) if isinstance(obj, (ObjectId, basestring)) else ObjectId(obj.pk) for obj in parents]
+    
+    def bulk_add(self, parents, *objs):
+        """
+        Add the given related objects to the relation of many model instances with
+        one multi-document update per object, which skips the instances that already
+        have it, without loading the model instances. parents can be a query set of
+        the model, or a list of instances or ObjectIds. When embedding, each embedded
+        copy is created only once.
+        
+        m2m_changed is sent once with the pre_add and post_add actions, instance=None
+        and the ids of the model instances in parent_pk_set. The model instances that
+        are already in memory are not updated.
+        """
+        parent_pks = self._parent_pks(parents)
+        manager = MongoDBM2MRelatedManager(self.field, self.field.rel, self.field.rel.embed)
+        add_objs = []
+        add_pks = set()
+        for obj in objs:
+            if isinstance(obj, (ObjectId, basestring)):
+                pk, instance = ObjectId(obj), None
+            else:
+                pk, instance = ObjectId(obj.pk), obj
+            if pk not in add_pks:
+                add_pks.add(pk)
+                add_objs.append(_RelatedObject(pk, instance))
+        add_obj_ids = [str(obj.pk) for obj in add_objs]
+        parent_ids = [str(pk) for pk in parent_pks]
+        m2m_changed.send(self.through, instance=None, action='pre_add', reverse=False, model=self.field.rel.to, pk_set=add_obj_ids, parent_pk_set=parent_ids, using='default')
+        if parent_pks and add_objs:
+            self.field._push(parent_pks, manager._get_db_prep_values(add_objs))
+        m2m_changed.send(self.through, instance=None, action='post_add', reverse=False, model=self.field.rel.to, pk_set=add_obj_ids, parent_pk_set=parent_ids, using='default')
+    
+    def bulk_remove(self, parents, *objs):
+        """
+        Remove the given related objects from the relation of many model instances
+        with a single multi-document update. parents and the signals are as in
+        bulk_add(), with the pre_remove and post_remove actions.
+        """
+        parent_pks = self._parent_pks(parents)
+        remove_pks = list(set(ObjectId(obj) if isinstance(obj, (ObjectId, basestring)) else ObjectId(obj.pk) for obj in objs))
+        removed_obj_ids = [str(pk) for pk in remove_pks]
+        parent_ids = [str(pk) for pk in parent_pks]
+        m2m_changed.send(self.through, instance=None, action='pre_remove', reverse=False, model=self.field.rel.to, pk_set=removed_obj_ids, parent_pk_set=parent_ids, using='default')
+        if parent_pks and remove_pks:
+            self.field._pull({'_id':{'$in':parent_pks}}, remove_pks)
+            if self.field.overflow_threshold is not None:
+                self.field._remove_overflow({'parent':{'$in':parent_pks}, 'related':{'$in':remove_pks}})
+        m2m_changed.send(self.through, instance=None, action='post_remove', reverse=False, model=self.field.rel.to, pk_set=removed_obj_ids, parent_pk_set=parent_ids, using='default')
+    
     def __set__(self, obj, value):
         """
         Attributes are being assigned to model instance. We redirect the assignments
         to the model instance's fields instances.
         """
-        obj.__dict__[self.field.name] = self.field.to_python(value)
+        manager = self.field.to_python(value)
+        if manager._overflow_stored:
+            # The overflow is loaded by the parent's pk
+            manager._overflow_owner = obj
+        obj.__dict__[self.field.name] = manager
 
 class MongoDBManyToManyRel(object):
     """
@@ -546,6 +2043,33 @@ class MongoDBManyToManyField(models.ManyToManyField):
     If you want the 'real' related (non-embedded) model instances, call all_objs() instead.
     If you want the list of related ObjectIds, call all_refs() instead.
     
+    Instead of True, embed can be a list of field names. Then only those fields
+    (and the pk) are stored in the embedded copies, and the related instances
+    are created with the other fields deferred, loading them when accessed.
+    
+    With cache='default' (or another cache alias), the related objects that
+    have to be loaded from the database are also kept in that Django cache
+    for cache_timeout seconds. Saving or deleting a related object removes it
+    from the cache. The cache hits and misses are counted in
+    field.related_cache.hits and field.related_cache.misses.
+    
+    With overflow_threshold=N, only the first N related objects are stored in
+    the model's documents, and the rest in a separate indexed collection, so the
+    documents stay small however large the relations grow. The manager works
+    the same, loading the rest when the whole list is first needed.
+    
+    With count_field='xxx_count', the model gains an indexed IntegerField of that
+    name holding the number of related objects. It is written on every save and
+    kept up to date by commit(), bulk_add(), bulk_remove() and resync_embedded()
+    with atomic updates, so the model can be sorted and filtered by relation size.
+    Instances already in memory are only updated by their own save() and commit().
+    
+    Embedded copies are not updated when the related objects change, unless
+    resync_embedded=True is given. Then saving a related object rewrites its
+    embedded copies in all parent documents, and deleting it pulls it from
+    them, without loading the parents. Use deferred_resync() to batch the
+    updates when changing many related objects.
+    
     The related model will also gain a new accessor method xxx_set() to make reverse queries.
     That accessor is a MongoDBM2MReverseManager that provides an all() method to return
     a QuerySet of related objects.
@@ -558,11 +2082,21 @@ class MongoDBManyToManyField(models.ManyToManyField):
     """
     description = 'ManyToMany field with references and optional embedded objects'
     
-    def __init__(self, to, related_name=None, embed=False, default=None, *args, **kwargs):
+    def __init__(self, to, related_name=None, embed=False, default=None, resync_embedded=False, cache=None, cache_timeout=300, overflow_threshold=None, count_field=None, *args, **kwargs):
         # Call Field, not super, to skip Django's ManyToManyField extra stuff we don't need
         self._mm2m_to_or_name = to
         self._mm2m_related_name = related_name
         self._mm2m_embed = embed
+        self._mm2m_resync_embedded = resync_embedded
+        self._mm2m_cache = cache
+        self._mm2m_cache_timeout = cache_timeout
+        self.related_cache = None
+        self.overflow_threshold = overflow_threshold
+        self._overflow_indexed = False
+        self._path_indexed = False
+        self.count_field = count_field
+        # Column of the counter, set when it has been added to the model
+        self.count_column = None
         models.Field.__init__(self, *args, **kwargs)
     
     def contribute_after_resolving(self, field, to, model):
@@ -572,6 +2106,18 @@ class MongoDBManyToManyField(models.ManyToManyField):
         self.default = MongoDBM2MRelatedManager(self, self.rel, self._mm2m_embed)
         self.rel.model = model
         self.rel.through = create_through(self, self.rel.model, self.rel.to)
+        # Fields stored in the embedded copies, None for all of them
+        self.embed_fields = None
+        if isinstance(self._mm2m_embed, (list, tuple)):
+            pk = to._meta.pk
+            self.embed_fields = [pk] + [to._meta.get_field(name) for name in self._mm2m_embed if name not in ('pk', pk.name)]
+        # Converts the related instances to stored values and back
+        self.codec = _RelationCodec(to, self._mm2m_embed and (self.embed_fields or to._meta.fields) or None, self)
+        if self._mm2m_cache:
+            # Second-level cache for the related objects, stored with all their fields
+            self.related_cache = RelatedObjectCache(to, _RelationCodec(to, to._meta.fields), self._mm2m_cache, self._mm2m_cache_timeout)
+            models.signals.post_save.connect(self._related_changed, sender=to, weak=False)
+            models.signals.post_delete.connect(self._related_changed, sender=to, weak=False)
         # Determine related name automatically unless set
         if not self.rel.related_name:
             self.rel.related_name = model._meta.object_name.lower() + '_set'
@@ -582,17 +2128,246 @@ class MongoDBManyToManyField(models.ManyToManyField):
         setattr(self.rel.to, self.rel.related_name, MongoDBM2MReverseDescriptor(model, self, self.rel, self.rel.embed))
         # Add the relationship descriptor to the model class for Django admin/forms to work
         setattr(model, self.name, MongoDBManyToManyRelationDescriptor(self, self.rel.through))
+        # Saving the model writes the whole list, so pending changes are no longer needed
+        models.signals.post_save.connect(self._post_save, sender=model, weak=False)
+        if self.overflow_threshold is not None:
+            models.signals.post_delete.connect(self._post_delete, sender=model, weak=False)
+        if self._mm2m_resync_embedded:
+            # Keep the embedded copies up to date when the related objects change
+            if self.rel.embed:
+                models.signals.post_save.connect(self._related_post_save, sender=self.rel.to, weak=False)
+            models.signals.post_delete.connect(self._related_post_delete, sender=self.rel.to, weak=False)
+        if self.overflow_threshold is not None or self._mm2m_resync_embedded:
+            models.signals.post_syncdb.connect(self._reset_indexes, weak=False)
+    
+    def _reset_indexes(self, **kwargs):
+        # syncdb and flush may have dropped the collections, so the indexes are created again on first use
+        self._overflow_indexed = False
+        self._path_indexed = False
+    
+    def _post_save(self, sender, instance, **kwargs):
+        manager = instance.__dict__.get(self.name)
+        if isinstance(manager, MongoDBM2MRelatedManager):
+            manager._reset_pending()
+            manager._save_overflow(instance.pk)
+    
+    def _post_delete(self, sender, instance, **kwargs):
+        # Delete the parent's objects in the overflow collection
+        if instance.pk is not None:
+            self.overflow_collection().remove({'parent':ObjectId(instance.pk)})
+    
+    def overflow_collection(self):
+        """
+        Return the collection that stores the objects beyond overflow_threshold,
+        one document per object: {parent, related, position, value}. The indexes
+        are created on first use.
+        """
+        collection = connections['default'].get_collection(self.rel.model._meta.db_table + '_' + self.column + '_overflow')
+        if not self._overflow_indexed:
+            collection.create_index([('parent', 1), ('position', 1)])
+            collection.create_index([('related', 1)])
+            self._overflow_indexed = True
+        return collection
+    
+    def _overflow_parents(self, pk):
+        """
+        Return the ids of the parents whose overflow contains the related object.
+        """
+        return [row['parent'] for row in self.overflow_collection().find({'related':ObjectId(pk)}, fields=['parent'])]
+    
+    def _related_changed(self, sender, instance, **kwargs):
+        # The cached copy is out of date
+        if instance.pk is not None:
+            self.related_cache.delete(instance.pk)
+    
+    def _related_post_save(self, sender, instance, **kwargs):
+        if kwargs.get('created'):
+            # A new object can't have embedded copies yet
+            return
+        queue = getattr(_resync_state, 'queue', None)
+        if queue is None:
+            self.resync_embedded(saved=[instance])
+        else:
+            queue.setdefault(self, ({}, set()))[0][ObjectId(instance.pk)] = instance
+    
+    def _related_post_delete(self, sender, instance, **kwargs):
+        queue = getattr(_resync_state, 'queue', None)
+        if queue is None:
+            self.resync_embedded(deleted=[instance.pk])
+        else:
+            saved, deleted = queue.setdefault(self, ({}, set()))
+            saved.pop(ObjectId(instance.pk), None)
+            deleted.add(ObjectId(instance.pk))
+    
+    def resync_embedded(self, saved=(), deleted=()):
+        """
+        Rewrite the embedded copies of the saved related instances in all parent
+        documents, with one multi-document update per instance, and pull the
+        deleted related objects (given as ids) with a single update. The parents
+        are found by the same column.pk path that reverse queries use, which is
+        indexed on first use, and they are not loaded into Python.
+        """
+        collection = _get_collection(self.rel.model)
+        pk_column = self.rel.to._meta.pk.column
+        path = self.column + '.' + pk_column
+        if not self._path_indexed:
+            collection.create_index([(path, 1)])
+            self._path_indexed = True
+        if self.rel.embed:
+            for instance in saved:
+                pk = ObjectId(instance.pk)
+                value = self.default.get_db_prep_value_embedded_instance(_RelatedObject(pk, instance))
+                collection.update({path:pk}, {'$set':{self.column + '.$':value}}, multi=True)
+                if self.overflow_threshold is not None:
+                    self.overflow_collection().update({'related':pk}, {'$set':{'value':value}}, multi=True)
+        if deleted:
+            pks = [ObjectId(pk) for pk in deleted]
+            self._pull({}, pks)
+            if self.overflow_threshold is not None:
+                self._remove_overflow({'related':{'$in':pks}})
+    
+    def _push(self, parent_pks, values):
+        """
+        Append the given stored values to the relation of the parents with the
+        given ObjectIds. Each value is pushed by its own update that only matches
+        the parents that don't contain the related object yet, also when they
+        have an outdated embedded copy or a bare ObjectId of it, which $addToSet
+        would not recognize. With a count_field, the same update increments it.
+        
+        With an overflow_threshold, the update only matches the parents with room
+        left in the document, and the values that didn't fit are appended to the
+        overflow collection by _push_overflow(). Returns the ObjectIds of the
+        parents that got objects in their overflow.
+        """
+        collection = _get_collection(self.rel.model)
+        pk_column = self.rel.to._meta.pk.column
+        path = self.column + '.' + pk_column
+        threshold = self.overflow_threshold
+        if threshold != 0:
+            for value in values:
+                pk = value[pk_column]
+                spec = {'_id':{'$in':parent_pks}, path:{'$ne':pk}, self.column:{'$nin':[pk, str(pk)]}}
+                if threshold is not None:
+                    # Only while there's no overflow yet and the list is shorter than the threshold
+                    spec[self.column + '.' + OVERFLOW_KEY] = {'$exists':False}
+                    spec['%s.%d' % (self.column, threshold - 1)] = {'$exists':False}
+                update = {'$push':{self.column:value}}
+                if self.count_column:
+                    update['$inc'] = {self.count_column:1}
+                collection.update(spec, update, multi=True)
+        if threshold is None:
+            return set()
+        return self._push_overflow(parent_pks, values)
+    
+    def _push_overflow(self, parent_pks, values):
+        """
+        Append the given stored values to the overflow of the parents that don't
+        contain them in the document or in the overflow, marking the documents as
+        overflowed and incrementing their count_field. Membership in the overflow
+        is checked with the indexed related query, without loading it.
+        """
+        collection = _get_collection(self.rel.model)
+        overflow = self.overflow_collection()
+        pk_column = self.rel.to._meta.pk.column
+        path = self.column + '.' + pk_column
+        values_by_parent = {}
+        for value in values:
+            pk = value[pk_column]
+            spec = {'_id':{'$in':parent_pks}, path:{'$ne':pk}, self.column:{'$nin':[pk, str(pk)]}}
+            parents = [doc['_id'] for doc in collection.find(spec, fields=['_id'])]
+            if not parents:
+                continue
+            existing = set(row['parent'] for row in overflow.find({'parent':{'$in':parents}, 'related':pk}, fields=['parent']))
+            for parent in parents:
+                if parent not in existing:
+                    values_by_parent.setdefault(parent, []).append(value)
+        if not values_by_parent:
+            return set()
+        self._append_overflow(values_by_parent)
+        parents = values_by_parent.keys()
+        collection.update({'_id':{'$in':parents}, self.column + '.' + OVERFLOW_KEY:{'$exists':False}}, {'$push':{self.column:{OVERFLOW_KEY:True}}}, multi=True)
+        if self.count_column:
+            # One update per number of added objects
+            parents_by_count = {}
+            for parent, parent_values in values_by_parent.items():
+                parents_by_count.setdefault(len(parent_values), []).append(parent)
+            for count, count_parents in parents_by_count.items():
+                collection.update({'_id':{'$in':count_parents}}, {'$inc':{self.count_column:count}}, multi=True)
+        return set(parents)
+    
+    def _append_overflow(self, values_by_parent):
+        """
+        Append stored values to the overflow collection after the last position of
+        each parent. values_by_parent maps parent ObjectIds to lists of values.
+        """
+        collection = self.overflow_collection()
+        pk_column = self.rel.to._meta.pk.column
+        last = dict((row['_id'], row['position']) for row in _aggregate(collection, [
+            {'$match':{'parent':{'$in':values_by_parent.keys()}}},
+            {'$group':{'_id':'$parent', 'position':{'$max':'$position'}}}]))
+        rows = []
+        for parent, values in values_by_parent.items():
+            start = last.get(parent, -1) + 1
+            rows.extend({'parent':parent, 'related':value[pk_column], 'position':start + i, 'value':value} for i, value in enumerate(values))
+        for start in xrange(0, len(rows), LOAD_CHUNK_SIZE):
+            collection.insert(rows[start:start + LOAD_CHUNK_SIZE])
+    
+    def _pull(self, spec, pks):
+        """
+        Pull the related objects with the given ObjectIds from the parent documents
+        matching spec. With a count_field, the counter is decremented by a separate
+        update per object, which only matches the documents that contain it.
+        
+        Bare ObjectIds or strings, as left by a migrated ListField(ForeignKey), are
+        pulled by a second update, because one update can't $pull both forms.
+        """
+        collection = _get_collection(self.rel.model)
+        pk_column = self.rel.to._meta.pk.column
+        path = self.column + '.' + pk_column
+        if self.count_column:
+            for pk in pks:
+                bare = [pk, str(pk)]
+                collection.update(dict(spec, **{path:pk}), {'$pull':{self.column:{pk_column:pk}}, '$inc':{self.count_column:-1}}, multi=True)
+                collection.update(dict(spec, **{self.column:{'$in':bare}}), {'$pull':{self.column:{'$in':bare}}, '$inc':{self.count_column:-1}}, multi=True)
+        else:
+            bare = list(pks) + [str(pk) for pk in pks]
+            collection.update(dict(spec, **{path:{'$in':pks}}), {'$pull':{self.column:{pk_column:{'$in':pks}}}}, multi=True)
+            collection.update(dict(spec, **{self.column:{'$in':bare}}), {'$pull':{self.column:{'$in':bare}}}, multi=True)
+    
+    def _remove_overflow(self, spec):
+        """
+        Remove the rows matching spec from the overflow collection, decrementing
+        the count_field of their parents first.
+        """
+        collection = self.overflow_collection()
+        if self.count_column:
+            parent_collection = _get_collection(self.rel.model)
+            for row in _aggregate(collection, [{'$match':spec}, {'$group':{'_id':'$parent', 'count':{'$sum':1}}}]):
+                parent_collection.update({'_id':row['_id']}, {'$inc':{self.count_column:-row['count']}})
+        collection.remove(spec)
     
     def contribute_to_class(self, model, name, *args, **kwargs):
         self.__m2m_name = name
         # Call Field, not super, to skip Django's ManyToManyField extra stuff we don't need
         models.Field.contribute_to_class(self, model, name, *args, **kwargs)
+        if self.count_field:
+            # Add the counter after this field, so pre_save() sets it before it's saved
+            counter = models.IntegerField(default=0, editable=False, db_index=True)
+            counter.contribute_to_class(model, self.count_field)
+            self.count_column = counter.column
         # Do the rest after resolving the 'to' relation
         add_lazy_relation(model, self, self._mm2m_to_or_name, self.contribute_after_resolving)
     
     def db_type(self, *args, **kwargs):
         return 'list'
     
+    def pre_save(self, model_instance, add):
+        value = models.Field.pre_save(self, model_instance, add)
+        if self.count_field and isinstance(value, MongoDBM2MRelatedManager):
+            # The whole list is written, so the counter is too
+            setattr(model_instance, self.count_field, value.count())
+        return value
+    
     def get_db_prep_value(self, value, connection, prepared=False):
         # The Python value is a MongoDBM2MRelatedManager, and we'll store the models it contains as a special list.
         if not isinstance(value, MongoDBM2MRelatedManager):
@@ -0,0 +1,158 @@
+"""
+Identity map for related objects loaded by MongoDBManyToManyFields.
+
+Within a unit of work (a request or a with block), every related object that
+the relation managers load from the database is remembered, keyed by its model
+and ObjectId. Relations that refer to the same object then share a single
+instance, and it's only queried once:
+
+with identity_map():
+    for article in TestArticle.objects.all():
+        print list(article.categories.all())
+
+To use one identity map per request, add IdentityMapMiddleware to
+MIDDLEWARE_CLASSES. Saving or deleting an object removes it from the map.
+"""
+from django.db.models.signals import post_save, post_delete
+from contextlib import contextmanager
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+# ObjectId has been moved to bson.objectid in newer versions of PyMongo
+try:
+    from bson.objectid import ObjectId
+    from bson.errors import InvalidId
+except ImportError:
+    from pymongo.objectid import ObjectId
+    from pymongo.errors import InvalidId
+
+# How many objects an identity map holds by default before evicting the least recently used
+DEFAULT_MAX_SIZE = 10000
+
+# Stack of active identity maps, per thread
+_state = threading.local()
+
+class IdentityMap(object):
+    """
+    Holds model instances keyed by (model, ObjectId). When more than max_size
+    instances are added, the least recently used ones are evicted.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self._objects = OrderedDict()
+    
+    def __len__(self):
+        return len(self._objects)
+    
+    def get(self, model, pk):
+        """
+        Return the instance of the model with the given pk, or None if it's not in the map.
+        """
+        key = (model, ObjectId(pk))
+        obj = self._objects.pop(key, None)
+        if obj is not None:
+            # Move to the end as the most recently used
+            self._objects[key] = obj
+        return obj
+    
+    def get_many(self, model, pks):
+        """
+        Return a dict that maps the given pks to the instances found in the map.
+        """
+        found = {}
+        for pk in pks:
+            obj = self.get(model, pk)
+            if obj is not None:
+                found[pk] = obj
+        return found
+    
+    def add(self, model, obj):
+        """
+        Add a model instance to the map, evicting the least recently used instances if needed.
+        """
+        key = (model, ObjectId(obj.pk))
+        self._objects.pop(key, None)
+        self._objects[key] = obj
+        while len(self._objects) > self.max_size:
+            del self._objects[next(iter(self._objects))]
+    
+    def remove(self, model, pk):
+        self._objects.pop((model, ObjectId(pk)), None)
+    
+    def clear(self):
+        self._objects.clear()
+
+def get_identity_map():
+    """
+    Return the innermost active identity map of this thread, or None.
+    """
+    stack = getattr(_state, 'stack', None)
+    return stack[-1] if stack else None
+
+def push_identity_map(max_size=DEFAULT_MAX_SIZE):
+    """
+    Start using a new identity map in this thread and return it.
+    """
+    if getattr(_state, 'stack', None) is None:
+        _state.stack = []
+    identity_map = IdentityMap(max_size)
+    _state.stack.append(identity_map)
+    return identity_map
+
+def pop_identity_map(identity_map=None):
+    """
+    Stop using the given identity map, or the innermost one, in this thread.
+    """
+    stack = getattr(_state, 'stack', None)
+    if not stack:
+        return
+    if identity_map is None:
+        stack.pop()
+    elif identity_map in stack:
+        stack.remove(identity_map)
+
+@contextmanager
+def identity_map(max_size=DEFAULT_MAX_SIZE):
+    """
+    Use an identity map for the related objects loaded within the with block.
+    """
+    identity_map = push_identity_map(max_size)
+    try:
+        yield identity_map
+    finally:
+        pop_identity_map(identity_map)
+
+class IdentityMapMiddleware(object):
+    """
+    Use an identity map for the related objects loaded during each request.
+    """
+    def process_request(self, request):
+        request._mongom2m_identity_map = push_identity_map()
+    
+    def process_response(self, request, response):
+        if hasattr(request, '_mongom2m_identity_map'):
+            pop_identity_map(request._mongom2m_identity_map)
+        return response
+    
+    def process_exception(self, request, exception):
+        if hasattr(request, '_mongom2m_identity_map'):
+            pop_identity_map(request._mongom2m_identity_map)
+
+def _forget_instance(sender, instance, **kwargs):
+    # Changed objects must be loaded again from the database
+    stack = getattr(_state, 'stack', None)
+    if stack and instance.pk is not None:
+        try:
+            pk = ObjectId(instance.pk)
+        except (InvalidId, TypeError):
+            # Not a MongoDB model
+            return
+        for identity_map in stack:
+            identity_map.remove(sender, pk)
+
+post_save.connect(_forget_instance, dispatch_uid='mongom2m.identitymap')
+post_delete.connect(_forget_instance, dispatch_uid='mongom2m.identitymap')
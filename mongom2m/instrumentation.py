@@ -0,0 +1,207 @@
+"""
+Instrumentation of the related object loads done by MongoDBManyToManyFields.
+
+Within a track_relations() block, the queries, fetched documents, cache hits,
+single object loads and the time spent converting embedded values are counted
+per field:
+
+with track_relations(max_single_loads=10) as tracker:
+    for article in TestArticle.objects.all():
+        print list(article.categories.all())
+print tracker.report()
+
+A RelationLoadWarning is issued at the end of the block for each relation that
+loaded more than max_single_loads objects one by one, which usually means it
+should be prefetched. The relation_pre_load and relation_post_load signals are
+sent around each load while tracking. When nothing is tracked, the relation
+code only checks the active flag of this module.
+"""
+from django.dispatch import Signal
+from contextlib import contextmanager
+import threading
+import warnings
+import time
+
+# Sent before and after loading related objects while tracking. pks is the list
+# of ObjectIds to load, single is True when one object is loaded by itself.
+relation_pre_load = Signal(providing_args=['field', 'pks', 'single'])
+relation_post_load = Signal(providing_args=['field', 'pks', 'single', 'loaded', 'duration'])
+
+# True when any thread is tracking, checked by the relation code before anything else
+active = False
+
+# Number of active trackers in all threads, and the stack of trackers per thread
+_count = 0
+_count_lock = threading.Lock()
+_state = threading.local()
+
+class RelationLoadWarning(UserWarning):
+    pass
+
+class RelationStats(object):
+    """
+    Counters of one relation field.
+    """
+    __slots__ = ('queries', 'documents', 'cache_hits', 'single_loads', 'decode_time', 'encode_time')
+    
+    def __init__(self):
+        self.queries = 0
+        self.documents = 0
+        self.cache_hits = 0
+        self.single_loads = 0
+        self.decode_time = 0.0
+        self.encode_time = 0.0
+    
+    def add(self, other):
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+    
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+class RelationTracker(object):
+    """
+    Collects the RelationStats of each field during a track_relations() block.
+    """
+    def __init__(self, max_single_loads=None):
+        self.max_single_loads = max_single_loads
+        self.stats = {}
+    
+    def __getitem__(self, field):
+        stats = self.stats.get(field)
+        if stats is None:
+            stats = self.stats[field] = RelationStats()
+        return stats
+    
+    def totals(self):
+        """
+        Return the sum of the counters of all fields.
+        """
+        totals = RelationStats()
+        for stats in self.stats.values():
+            totals.add(stats)
+        return totals
+    
+    def report(self):
+        """
+        Return a text report of the counters, one line per field.
+        """
+        lines = []
+        for field, stats in sorted(self.stats.items(), key=lambda item: _field_name(item[0])):
+            lines.append('%s: %d queries, %d documents, %d cache hits, %d single loads, %.1f ms decoding, %.1f ms encoding' % (
+                _field_name(field), stats.queries, stats.documents, stats.cache_hits, stats.single_loads, stats.decode_time * 1000, stats.encode_time * 1000))
+        return '\n'.join(lines)
+    
+    def warn(self):
+        """
+        Warn about the fields that loaded too many objects one by one.
+        """
+        if self.max_single_loads is None:
+            return
+        for field, stats in self.stats.items():
+            if stats.single_loads > self.max_single_loads:
+                warnings.warn('%s loaded %d related objects one at a time, consider prefetch_m2m()' % (_field_name(field), stats.single_loads), RelationLoadWarning, stacklevel=4)
+
+def _field_name(field):
+    model = getattr(field, 'model', None)
+    if model is None:
+        return getattr(field, 'name', str(field))
+    return '%s.%s.%s' % (model._meta.app_label, model._meta.object_name, field.name)
+
+def _set_count(delta):
+    global active, _count
+    with _count_lock:
+        _count += delta
+        active = _count > 0
+
+def start_tracking(max_single_loads=None):
+    """
+    Start tracking the relation loads in this thread and return the tracker.
+    """
+    if getattr(_state, 'stack', None) is None:
+        _state.stack = []
+    tracker = RelationTracker(max_single_loads)
+    _state.stack.append(tracker)
+    _set_count(1)
+    return tracker
+
+def stop_tracking(tracker):
+    """
+    Stop tracking with the given tracker and warn about too many single loads.
+    """
+    stack = getattr(_state, 'stack', None)
+    if stack and tracker in stack:
+        stack.remove(tracker)
+        _set_count(-1)
+    tracker.warn()
+
+@contextmanager
+def track_relations(max_single_loads=None):
+    """
+    Track the relation loads in the with block. Yields the RelationTracker.
+    """
+    tracker = start_tracking(max_single_loads)
+    try:
+        yield tracker
+    finally:
+        stop_tracking(tracker)
+
+def _trackers():
+    return getattr(_state, 'stack', None) or ()
+
+# The field whose objects are being loaded, for counting the queries
+_current = threading.local()
+
+def track_load(field, pks, load, single=False):
+    """
+    Call load() to load the related objects of the field with the given pks,
+    counting the load and sending the signals. Returns what load() returns.
+    """
+    trackers = _trackers()
+    if not trackers:
+        return load()
+    relation_pre_load.send(sender=field.model, field=field, pks=pks, single=single)
+    previous = getattr(_current, 'field', None)
+    _current.field = field
+    start = time.time()
+    try:
+        loaded = load()
+    finally:
+        _current.field = previous
+    duration = time.time() - start
+    if single:
+        for tracker in trackers:
+            tracker[field].single_loads += 1
+    relation_post_load.send(sender=field.model, field=field, pks=pks, single=single, loaded=loaded, duration=duration)
+    return loaded
+
+def record_query(documents, field=None):
+    """
+    Count a query that fetched the given number of documents. The field
+    defaults to the one whose objects are being loaded by track_load().
+    """
+    field = field or getattr(_current, 'field', None)
+    if field is None:
+        return
+    for tracker in _trackers():
+        stats = tracker[field]
+        stats.queries += 1
+        stats.documents += documents
+
+def record_cache_hits(hits, field=None):
+    """
+    Count objects that were found in the cache instead of querying them.
+    """
+    field = field or getattr(_current, 'field', None)
+    if field is None:
+        return
+    for tracker in _trackers():
+        tracker[field].cache_hits += hits
+
+def record_time(field, name, seconds):
+    """
+    Add to the decode_time or encode_time of the field.
+    """
+    for tracker in _trackers():
+        stats = tracker[field]
+        setattr(stats, name, getattr(stats, name) + seconds)
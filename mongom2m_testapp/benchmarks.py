@@ -0,0 +1,272 @@
+"""
+Benchmarks for the mongom2m hot paths. Run them all with the management
+command of a project that has mongom2m_testapp installed:
+
+./manage.py mongom2m_benchmark --mongomock --output=results.json
+
+or one by one from the Django shell:
+
+>>> from mongom2m_testapp.benchmarks import bench_codec
+>>> bench_codec()
+{'encode': 7.5, 'decode': 12.0}
+
+The benchmarks that use the database create their data in the configured
+MongoDB database and delete it afterwards, so use a test database, or
+--mongomock to run them offline against an in-memory mongomock database.
+"""
+from django.db import connections
+from mongom2m.fields import MongoDBM2MRelatedManager
+from models import TestArticle, TestCategory, TestTag
+import timeit
+import time
+
+# ObjectId has been moved to bson.objectid in newer versions of PyMongo
+try:
+    from bson.objectid import ObjectId
+except ImportError:
+    from pymongo.objectid import ObjectId
+
+# Relation sizes for the benchmarks that don't use the database, and for the ones that do
+SIZES = (10, 1000, 100000)
+DB_SIZES = (10, 1000)
+
+# Collection methods that send a query or a write to MongoDB
+QUERY_METHODS = ('find', 'find_one', 'find_and_modify', 'insert', 'save', 'update', 'remove', 'aggregate', 'map_reduce', 'group', 'distinct')
+
+def bench_codec(size=1000, number=20):
+    """
+    Measure converting an embedded relation list of the given size to its
+    database representation (encode) and back to model instances (decode).
+    No database access is needed.
+    """
+    field = TestArticle._meta.get_field('tags')
+    manager = field.default()
+    manager.add(*[TestTag(id=str(ObjectId()), name='test tag %d' % i) for i in xrange(size)])
+    values = manager.get_db_prep_value()
+    def decode():
+        for obj in field.to_python(values).objects:
+            obj.obj
+    return {
+        'encode': timeit.timeit(manager.get_db_prep_value, number=number) * 1e6 / number / size,
+        'decode': timeit.timeit(decode, number=number) * 1e6 / number / size,
+    }
+
+# PyMongo 2 options that mongomock doesn't accept
+PYMONGO2_OPTIONS = ('safe', 'w', 'wtimeout', 'j', 'fsync', 'slave_okay', 'read_preference', 'tag_sets',
+                    'secondary_acceptable_latency_ms', 'timeout', 'network_timeout', 'snapshot', 'tailable',
+                    'await_data', 'partial', 'exhaust', 'as_class', 'compile_re')
+
+class _MongomockCollection(object):
+    """
+    Collection of a mongomock database that accepts the PyMongo 2 API used by
+    django-mongodb-engine and mongom2m: the fields argument of find() and
+    find_one(), and the write concern options of the write methods.
+    """
+    def __init__(self, database, name, **kwargs):
+        self.__dict__['_collection'] = database[name]
+    
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+    
+    def __setattr__(self, name, value):
+        setattr(self._collection, name, value)
+    
+    def _options(self, kwargs):
+        for name in PYMONGO2_OPTIONS:
+            kwargs.pop(name, None)
+        if 'fields' in kwargs:
+            kwargs['projection'] = kwargs.pop('fields')
+        return kwargs
+    
+    def find(self, spec=None, fields=None, **kwargs):
+        return self._collection.find(spec, fields, **self._options(kwargs))
+    
+    def find_one(self, spec_or_id=None, *args, **kwargs):
+        return self._collection.find_one(spec_or_id, *args, **self._options(kwargs))
+    
+    def insert(self, doc_or_docs, *args, **kwargs):
+        return self._collection.insert(doc_or_docs, *args, **self._options(kwargs))
+    
+    def save(self, to_save, *args, **kwargs):
+        return self._collection.save(to_save, *args, **self._options(kwargs))
+    
+    def update(self, spec, document, *args, **kwargs):
+        return self._collection.update(spec, document, *args, **self._options(kwargs))
+    
+    def remove(self, spec_or_id=None, *args, **kwargs):
+        return self._collection.remove(spec_or_id, *args, **self._options(kwargs))
+
+def use_mongomock(connection=None):
+    """
+    Connect a django-mongodb-engine connection, the default one if not given,
+    to a new in-memory mongomock database, and use mongomock collections for it.
+    """
+    import mongomock
+    import django_mongodb_engine.base
+    if connection is None:
+        connection = connections['default']
+    client_class = django_mongodb_engine.base.Connection
+    django_mongodb_engine.base.Connection = getattr(mongomock, 'Connection', None) or mongomock.MongoClient
+    try:
+        connection._reconnect()
+    finally:
+        django_mongodb_engine.base.Connection = client_class
+    connection.collection_class = _MongomockCollection
+
+class _CountingCollection(object):
+    """
+    Collection proxy that counts the queries sent to MongoDB.
+    """
+    def __init__(self, collection, counter):
+        self.__dict__['_collection'] = collection
+        self.__dict__['_counter'] = counter
+    
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in QUERY_METHODS:
+            counter = self._counter
+            def counted(*args, **kwargs):
+                counter.queries += 1
+                return attr(*args, **kwargs)
+            return counted
+        return attr
+    
+    def __setattr__(self, name, value):
+        setattr(self._collection, name, value)
+
+class QueryCounter(object):
+    """
+    Counts the queries sent through the default database connection in a with block.
+    """
+    def __init__(self):
+        self.queries = 0
+    
+    def __enter__(self):
+        connection = connections['default']
+        self._collection_class = collection_class = connection.collection_class
+        connection.collection_class = lambda *args, **kwargs: _CountingCollection(collection_class(*args, **kwargs), self)
+        return self
+    
+    def __exit__(self, *exc_info):
+        connections['default'].collection_class = self._collection_class
+
+def measure(function, number=1, setup=None):
+    """
+    Call function number times, calling setup before each call without measuring it.
+    Returns the average wall time in seconds and number of queries of a call.
+    """
+    elapsed = 0.0
+    with QueryCounter() as counter:
+        for i in xrange(number):
+            if setup:
+                queries = counter.queries
+                setup()
+                counter.queries = queries
+            start = time.time()
+            function()
+            elapsed += time.time() - start
+    return {'time':elapsed / number, 'queries':counter.queries / float(number)}
+
+def _tags(size):
+    # Unsaved tags with ids, for the benchmarks that don't use the database
+    return [TestTag(id=str(ObjectId()), name='test tag %d' % i) for i in xrange(size)]
+
+def bench_manager(size, number=5):
+    """
+    Measure add(), remove() and membership tests on a relation of the given size.
+    """
+    field = TestArticle._meta.get_field('tags')
+    tags = _tags(size)
+    state = {}
+    def setup_add():
+        state['manager'] = MongoDBM2MRelatedManager(field, field.rel, field.rel.embed)
+    def setup_remove():
+        state['manager'] = MongoDBM2MRelatedManager(field, field.rel, field.rel.embed)
+        state['manager'].add(*tags)
+    removed = tags[::max(1, size / 10)]
+    probes = [tag.pk for tag in tags[::max(1, size / 1000)]] + [str(ObjectId()) for i in xrange(100)]
+    def contains():
+        manager = state['manager']
+        for pk in probes:
+            pk in manager
+    return {
+        'add':measure(lambda: state['manager'].add(*tags), number, setup_add),
+        'remove':measure(lambda: state['manager'].remove(*removed), number, setup_remove),
+        'contains':measure(contains, number, setup_remove),
+    }
+
+def bench_conversion(size, number=5):
+    """
+    Measure to_python() and get_db_prep_value() with and without embedding.
+    to_python() includes creating the model instances of the embedded values.
+    """
+    results = {}
+    for name, field_name in (('embed', 'tags'), ('no_embed', 'categories')):
+        field = TestArticle._meta.get_field(field_name)
+        manager = MongoDBM2MRelatedManager(field, field.rel, field.rel.embed)
+        if field.rel.embed:
+            manager.add(*_tags(size))
+        else:
+            manager.add(*[ObjectId() for i in xrange(size)])
+        values = manager.get_db_prep_value()
+        def to_python():
+            for obj in field.to_python(values).objects:
+                obj.obj if field.rel.embed else obj.pk
+        results[name] = {
+            'to_python':measure(to_python, number),
+            'get_db_prep_value':measure(manager.get_db_prep_value, number),
+        }
+    return results
+
+def bench_queries(size, number=3):
+    """
+    Measure iterating over a saved relation, the reverse relation, and looking
+    up relationships of the through model like the admin inlines do.
+    """
+    category = TestCategory(title='benchmark category')
+    category.save()
+    categories = [TestCategory(title='benchmark category %d' % i) for i in xrange(size)]
+    tags = [TestTag(name='benchmark tag %d' % i) for i in xrange(size)]
+    articles = []
+    try:
+        for obj in categories + tags:
+            obj.save()
+        article = TestArticle(title='benchmark article', text='benchmark', main_category=category)
+        article.categories.add(*categories)
+        article.tags.add(*tags)
+        article.save()
+        articles.append(article)
+        for i in xrange(size):
+            other = TestArticle(title='benchmark article %d' % i, text='benchmark', main_category=category)
+            other.categories.add(category)
+            other.save()
+            articles.append(other)
+        through = TestArticle.categories.through
+        forward_key = '%s$f$%s' % (article.pk, categories[-1].pk)
+        reverse_key = '%s$r$%s' % (category.pk, articles[-1].pk)
+        return {
+            'forward_iteration':measure(lambda: list(TestArticle.objects.get(pk=article.pk).categories.all()), number),
+            'forward_iteration_embed':measure(lambda: list(TestArticle.objects.get(pk=article.pk).tags.all()), number),
+            'reverse_all':measure(lambda: list(category.testarticle_set.all()), number),
+            'through_get':measure(lambda: through.objects.get(pk=forward_key), number),
+            'through_get_reverse':measure(lambda: through.objects.get(pk=reverse_key), number),
+        }
+    finally:
+        # Delete the raw documents, so the related objects are not resynced one by one
+        for model, objs in ((TestArticle, articles), (TestCategory, categories + [category]), (TestTag, tags)):
+            pks = [ObjectId(obj.pk) for obj in objs if obj.pk is not None]
+            connections['default'].get_collection(model._meta.db_table).remove({'_id':{'$in':pks}})
+
+def run_benchmarks(sizes=SIZES, db_sizes=DB_SIZES, number=5):
+    """
+    Run all the benchmarks and return the results as a dict that can be
+    serialized to JSON. Each result has the average wall time (seconds) and
+    number of queries of one operation, keyed by benchmark and size.
+    """
+    results = {'manager':{}, 'conversion':{}, 'queries':{}}
+    for size in sizes:
+        results['manager'][str(size)] = bench_manager(size, number)
+        results['conversion'][str(size)] = bench_conversion(size, number)
+    for size in db_sizes:
+        results['queries'][str(size)] = bench_queries(size, number)
+    return results
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from optparse import make_option
+import json
+import sys
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--mongomock', action='store_true', dest='mongomock', default=False,
+            help='Run against an in-memory mongomock database instead of the configured MongoDB.'),
+        make_option('--sizes', dest='sizes', default=None,
+            help='Comma separated relation sizes for the benchmarks without database access.'),
+        make_option('--db-sizes', dest='db_sizes', default=None,
+            help='Comma separated relation sizes for the benchmarks that use the database.'),
+        make_option('--number', dest='number', type='int', default=5,
+            help='How many times to run each benchmark.'),
+        make_option('--output', dest='output', default=None,
+            help='File to write the JSON results to, instead of standard output.'),
+    )
+    help = 'Run the mongom2m benchmarks and output the wall times and query counts as JSON.'
+
+    def handle(self, *args, **options):
+        from mongom2m_testapp import benchmarks
+        if options.get('mongomock'):
+            benchmarks.use_mongomock()
+        sizes = benchmarks.SIZES
+        if options.get('sizes'):
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        db_sizes = benchmarks.DB_SIZES
+        if options.get('db_sizes'):
+            db_sizes = [int(size) for size in options['db_sizes'].split(',')]
+        results = benchmarks.run_benchmarks(sizes, db_sizes, options.get('number') or 5)
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options.get('output'):
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            sys.stdout.write(output + '\n')
@@ -28,6 +28,14 @@ class TestArticle(models.Model):
     def __unicode__(self):
         return self.title
 
+class TestMenu(models.Model):
+    objects = MongoDBManager()
+    title = models.CharField(max_length=254)
+    categories = MongoDBManyToManyField(TestCategory, related_name='menus', cache='default')
+    
+    def __unicode__(self):
+        return self.title
+
 class TestAuthor(models.Model):
     objects = MongoDBManager()
     name = models.CharField(max_length=254)
@@ -40,3 +48,42 @@ class TestBook(models.Model):
     authors = MongoDBManyToManyField(TestAuthor)
     text = models.TextField()
 
+class TestWriter(models.Model):
+    objects = MongoDBManager()
+    name = models.CharField(max_length=254)
+    bio = models.TextField(blank=True)
+    
+    def __unicode__(self):
+        return self.name
+
+class TestAnthology(models.Model):
+    objects = MongoDBManager()
+    title = models.CharField(max_length=254)
+    authors = MongoDBManyToManyField(TestWriter, related_name='anthologies', embed=['name'])
+    
+    def __unicode__(self):
+        return self.title
+
+class TestTagSet(models.Model):
+    objects = MongoDBManager()
+    name = models.CharField(max_length=254)
+    tags = MongoDBManyToManyField(TestTag, related_name='tag_sets', embed=True, overflow_threshold=3, count_field='tag_count')
+    
+    def __unicode__(self):
+        return self.name
+
+class TestNewsletter(models.Model):
+    objects = MongoDBManager()
+    title = models.CharField(max_length=254)
+    tags = MongoDBManyToManyField(TestTag, related_name='newsletters', embed=True, resync_embedded=True)
+    
+    def __unicode__(self):
+        return self.title
+
+class TestIssue(models.Model):
+    objects = MongoDBManager()
+    title = models.CharField(max_length=254)
+    articles = MongoDBManyToManyField(TestArticle, related_name='issues')
+    
+    def __unicode__(self):
+        return self.title
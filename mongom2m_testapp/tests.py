@@ -1,12 +1,49 @@
 from django.test import TestCase
-from django.db import models
+from django.db import models, connections
+from django.db.models.query_utils import DeferredAttribute
 from django.db.models.signals import m2m_changed
-from mongom2m.fields import MongoDBManyToManyField
+from mongom2m.fields import MongoDBManyToManyField, MISSING_SKIP, MISSING_NONE, prefetch_m2m, prefetch_reverse, deferred_resync
 from django_mongodb_engine.contrib import MongoDBManager
+from mongom2m.identitymap import IdentityMap, identity_map
+from mongom2m.instrumentation import track_relations, relation_post_load, RelationLoadWarning
 from djangotoolbox.fields import ListField, EmbeddedModelField
-from models import TestArticle, TestCategory, TestTag, TestAuthor, TestBook#, TestOldArticle, TestOldEmbeddedArticle
+from models import TestArticle, TestCategory, TestTag, TestAuthor, TestBook, TestWriter, TestAnthology, TestMenu, TestTagSet, TestNewsletter, TestIssue#, TestOldArticle, TestOldEmbeddedArticle
 from pymongo.objectid import ObjectId
 import sys
+import warnings
+
+class _CountedCollection(object):
+    """
+    Collection proxy that counts the queries and writes sent through it.
+    """
+    METHODS = ('find', 'find_one', 'find_and_modify', 'insert', 'save', 'update', 'remove', 'aggregate', 'map_reduce', 'group', 'distinct')
+    
+    def __init__(self, collection, counter):
+        self.__dict__['_collection'] = collection
+        self.__dict__['_counter'] = counter
+    
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in self.METHODS:
+            return attr
+        def counted(*args, **kwargs):
+            self._counter.queries += 1
+            return attr(*args, **kwargs)
+        return counted
+
+class count_queries(object):
+    """
+    Count the queries sent through the default connection in a with block.
+    """
+    def __enter__(self):
+        self.queries = 0
+        connection = connections['default']
+        self._collection_class = collection_class = connection.collection_class
+        connection.collection_class = lambda *args, **kwargs: _CountedCollection(collection_class(*args, **kwargs), self)
+        return self
+    
+    def __exit__(self, *exc_info):
+        connections['default'].collection_class = self._collection_class
 
 class MongoDBManyToManyFieldTest(TestCase):
     def test_m2m(self):
@@ -252,4 +289,1022 @@ class MongoDBManyToManyFieldTest(TestCase):
         article.categories.clear()
         self.assertEqual(self.on_clear_called, 2)
         m2m_changed.disconnect(on_clear)
+    
+    def test_batch_loading(self):
+        """
+        Test loading the related objects in batches when iterating.
+        """
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        category2 = TestCategory(title='test cat 2')
+        category2.save()
+        category3 = TestCategory(title='test cat 3')
+        category3.save()
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=category3)
+        article.categories.add(category3, category1, category2)
+        article.save()
+        
+        # Objects are returned in the stored order
+        new_article = TestArticle.objects.get(id=article.id)
+        self.assertEqual([cat.title for cat in new_article.categories.all()], ['test cat 3', 'test cat 1', 'test cat 2'])
+        self.assertEqual([cat.title for cat in new_article.categories.objs()], ['test cat 3', 'test cat 1', 'test cat 2'])
+        self.assertEqual([cat.title for cat in new_article.categories], ['test cat 3', 'test cat 1', 'test cat 2'])
+        
+        # Missing objects are handled as requested
+        category1.delete()
+        new_article = TestArticle.objects.get(id=article.id)
+        self.assertRaises(TestCategory.DoesNotExist, list, new_article.categories.all())
+        self.assertEqual([cat.title for cat in new_article.categories.all(missing=MISSING_SKIP)], ['test cat 3', 'test cat 2'])
+        self.assertEqual([cat and cat.title for cat in new_article.categories.objs(missing=MISSING_NONE)], ['test cat 3', None, 'test cat 2'])
+    
+    def test_prefetch(self):
+        """
+        Test prefetching the related objects of many instances at once.
+        """
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        category2 = TestCategory(title='test cat 2')
+        category2.save()
+        tag1 = TestTag(name='test tag 1')
+        tag1.save()
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=category1)
+        article.categories.add(category1, category2)
+        article.tags.add(tag1)
+        article.save()
+        article2 = TestArticle(title='test article 2', text='test article 2 text', main_category=category1)
+        article2.categories.add(category2)
+        article2.save()
+        
+        articles = prefetch_m2m(TestArticle.objects.all().order_by('title'), 'categories', 'tags')
+        self.assertEqual(len(articles), 2)
+        # All related objects are loaded, and shared between the instances
+        for a in articles:
+            for obj in a.categories.objects + a.tags.objects:
+                self.assertTrue(obj.obj is not None)
+        self.assertTrue(articles[0].categories.objects[1].obj is articles[1].categories.objects[0].obj)
+        self.assertEqual([cat.title for cat in articles[0].categories.all()], ['test cat 1', 'test cat 2'])
+        self.assertEqual([cat.title for cat in articles[1].categories.all()], ['test cat 2'])
+        self.assertEqual([tag.name for tag in articles[0].tags.all()], ['test tag 1'])
+    
+    def test_membership(self):
+        """
+        Test adding, removing and checking membership of related objects.
+        """
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        category2 = TestCategory(title='test cat 2')
+        category2.save()
+        category3 = TestCategory(title='test cat 3')
+        category3.save()
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=category1)
+        # Duplicates are only added once, also within the same call
+        article.categories.add(category1, category2, category1.id, ObjectId(category2.id))
+        self.assertEqual(article.categories.ids(), [ObjectId(category1.id), ObjectId(category2.id)])
+        self.assertTrue(category1 in article.categories)
+        self.assertTrue(category2.id in article.categories)
+        self.assertFalse(category3 in article.categories)
+        article.categories.add(category3)
+        article.categories.remove(category1, category1.id)
+        self.assertEqual(article.categories.ids(), [ObjectId(category2.id), ObjectId(category3.id)])
+        self.assertFalse(category1 in article.categories)
+        self.assertTrue(ObjectId(category3.id) in article.categories)
+        article.categories.add(category1)
+        self.assertEqual(article.categories.ids(), [ObjectId(category2.id), ObjectId(category3.id), ObjectId(category1.id)])
+        article.categories.clear()
+        self.assertFalse(category2 in article.categories)
+        self.assertEqual(article.categories.count(), 0)
+    
+    def test_commit(self):
+        """
+        Test persisting add/remove/clear changes as atomic updates.
+        """
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        category2 = TestCategory(title='test cat 2')
+        category2.save()
+        tag1 = TestTag(name='test tag 1')
+        tag1.save()
+        tag2 = TestTag(name='test tag 2')
+        tag2.save()
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=category1)
+        article.tags.add(tag1)
+        article.save()
+        
+        # Two copies of the same article add different objects without overwriting each other
+        copy1 = TestArticle.objects.get(id=article.id)
+        copy2 = TestArticle.objects.get(id=article.id)
+        copy1.categories.add(category1)
+        copy1.tags.add(tag2.id)
+        copy1.categories.commit()
+        copy1.tags.commit()
+        copy2.categories.add(category2)
+        copy2.categories.commit()
+        new_article = TestArticle.objects.get(id=article.id)
+        self.assertEqual([cat.title for cat in new_article.categories.all()], ['test cat 1', 'test cat 2'])
+        self.assertEqual([tag.name for tag in new_article.tags.all()], ['test tag 1', 'test tag 2'])
+        
+        # An object that another copy has committed is not added twice, also when
+        # its stored copy is outdated or a bare ObjectId
+        tag1.name = 'renamed tag 1'
+        tag1.save()
+        copy2.tags.add(tag1)
+        copy2.tags.commit()
+        self.assertEqual([tag.name for tag in TestArticle.objects.get(id=article.id).tags.all()], ['test tag 1', 'test tag 2'])
+        collection = connections['default'].get_collection(TestArticle._meta.db_table)
+        collection.update({'_id':ObjectId(article.id)}, {'$set':{'categories':[ObjectId(category1.id), {'id':ObjectId(category2.id)}]}})
+        copy2.categories.add(category1)
+        copy2.categories.commit()
+        self.assertEqual(TestArticle.objects.get(id=article.id).categories.ids(), [ObjectId(category1.id), ObjectId(category2.id)])
+        # Bare ObjectIds and strings are removed as well, also through the through model
+        collection.update({'_id':ObjectId(article.id)}, {'$set':{'categories':[ObjectId(category1.id), str(category2.id)]}})
+        migrated = TestArticle.objects.get(id=article.id)
+        migrated.categories.remove(category2)
+        migrated.categories.commit()
+        self.assertEqual(collection.find_one({'_id':ObjectId(article.id)})['categories'], [ObjectId(category1.id)])
+        TestArticle.categories.through(**{'testarticle':migrated, 'testcategory':category1}).delete()
+        self.assertEqual(collection.find_one({'_id':ObjectId(article.id)})['categories'], [])
+        collection.update({'_id':ObjectId(article.id)}, {'$set':{'categories':[{'id':ObjectId(category1.id)}, {'id':ObjectId(category2.id)}]}})
+        
+        # Removing
+        new_article.categories.remove(category1)
+        new_article.tags.remove(tag1)
+        new_article.categories.commit()
+        new_article.tags.commit()
+        new_article = TestArticle.objects.get(id=article.id)
+        self.assertEqual([cat.title for cat in new_article.categories.all()], ['test cat 2'])
+        self.assertEqual([tag.name for tag in new_article.tags.all()], ['test tag 2'])
+        
+        # Clearing and adding again
+        new_article.categories.clear()
+        new_article.categories.add(category1)
+        new_article.categories.commit()
+        new_article = TestArticle.objects.get(id=article.id)
+        self.assertEqual([cat.title for cat in new_article.categories.all()], ['test cat 1'])
+        
+        # The through model commits the changes
+        through = TestArticle.categories.through
+        through(**{'testarticle':new_article, 'testcategory':category2}).save()
+        self.assertEqual(TestArticle.objects.get(id=article.id).categories.count(), 2)
+        through(**{'testarticle':new_article, 'testcategory':category1}).delete()
+        self.assertEqual([cat.title for cat in TestArticle.objects.get(id=article.id).categories.all()], ['test cat 2'])
+    
+    def test_query_pushdown(self):
+        """
+        Test filtering, ordering and slicing the related objects.
+        """
+        categories = []
+        for title in ('c', 'ab', 'b', 'aa'):
+            category = TestCategory(title=title)
+            category.save()
+            categories.append(category)
+        other = TestCategory(title='ac')
+        other.save()
+        tags = []
+        for name in ('tag b', 'tag a', 'other'):
+            tag = TestTag(name=name)
+            tag.save()
+            tags.append(tag)
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=categories[0])
+        article.categories.add(*categories)
+        article.tags.add(*tags)
+        article.save()
+        article = TestArticle.objects.get(id=article.id)
+        
+        # Filtering keeps the stored order and doesn't find objects outside the relation
+        self.assertEqual([cat.title for cat in article.categories.all().filter(title__startswith='a')], ['ab', 'aa'])
+        self.assertEqual(article.categories.all().filter(title__startswith='a').count(), 2)
+        # Ordering and slicing
+        self.assertEqual([cat.title for cat in article.categories.all().order_by('title')], ['aa', 'ab', 'b', 'c'])
+        self.assertEqual([cat.title for cat in article.categories.all().filter(title__startswith='a').order_by('title')[:1]], ['aa'])
+        self.assertEqual([cat.title for cat in article.categories.all().order_by('-title')[1:3]], ['b', 'ab'])
+        self.assertEqual([cat.title for cat in article.categories.all()[1:3]], ['ab', 'b'])
+        self.assertEqual(article.categories.all().order_by('title')[0].title, 'aa')
+        
+        # Embedded copies are filtered in memory, so changes in the database don't affect the result
+        tags[0].name = 'renamed'
+        tags[0].save()
+        self.assertEqual([tag.name for tag in article.tags.all().filter(name__startswith='tag').order_by('name')], ['tag a', 'tag b'])
+        self.assertEqual([tag.name for tag in article.tags.all().filter(pk__in=[tags[2].id, tags[0].id])], ['tag b', 'other'])
+        # Objects loaded fresh from the database are queried from the database
+        self.assertEqual([tag.name for tag in article.tags.objs().filter(name__startswith='tag')], ['tag a'])
+    
+    def test_resync_embedded(self):
+        """
+        Test updating the embedded copies when the related objects change.
+        """
+        tag1 = TestTag(name='test tag 1')
+        tag1.save()
+        tag2 = TestTag(name='test tag 2')
+        tag2.save()
+        tag3 = TestTag(name='test tag 3')
+        tag3.save()
+        newsletter = TestNewsletter(title='test newsletter 1')
+        newsletter.tags.add(tag1, tag2, tag3)
+        newsletter.save()
+        newsletter2 = TestNewsletter(title='test newsletter 2')
+        newsletter2.tags.add(tag2)
+        newsletter2.save()
+        
+        tag2.name = 'renamed tag 2'
+        tag2.save()
+        self.assertEqual([tag.name for tag in TestNewsletter.objects.get(id=newsletter.id).tags.all()], ['test tag 1', 'renamed tag 2', 'test tag 3'])
+        self.assertEqual([tag.name for tag in TestNewsletter.objects.get(id=newsletter2.id).tags.all()], ['renamed tag 2'])
+        # The parents are found by the indexed path
+        self.assertTrue('tags.id_1' in connections['default'].get_collection(TestNewsletter._meta.db_table).index_information())
+        # Creating a related object doesn't look for copies of it
+        with count_queries() as counter:
+            TestTag(name='test tag 4').save()
+            self.assertEqual(counter.queries, 1)
+        tag1.delete()
+        self.assertEqual([tag.name for tag in TestNewsletter.objects.get(id=newsletter.id).tags.all()], ['renamed tag 2', 'test tag 3'])
+        
+        # Deferred updates are written at the end of the block
+        with deferred_resync():
+            tag2.name = 'tag 2 again'
+            tag2.save()
+            tag3.name = 'renamed tag 3'
+            tag3.save()
+            self.assertEqual([tag.name for tag in TestNewsletter.objects.get(id=newsletter.id).tags.all()], ['renamed tag 2', 'test tag 3'])
+            tag2.delete()
+        self.assertEqual([tag.name for tag in TestNewsletter.objects.get(id=newsletter.id).tags.all()], ['renamed tag 3'])
+        self.assertEqual(TestNewsletter.objects.get(id=newsletter2.id).tags.count(), 0)
+        
+        # Without resync_embedded the copies are left as they were
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=category1)
+        article.tags.add(tag3)
+        article.save()
+        tag3.name = 'tag 3 again'
+        tag3.save()
+        self.assertEqual([tag.name for tag in TestArticle.objects.get(id=article.id).tags.all()], ['renamed tag 3'])
+    
+    def test_lazy_decoding(self):
+        """
+        Test decoding the related objects only when they are accessed.
+        """
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        tag1 = TestTag(name='test tag 1')
+        tag1.save()
+        tag2 = TestTag(name='test tag 2')
+        tag2.save()
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=category1)
+        article.categories.add(category1)
+        article.tags.add(tag1, tag2)
+        article.save()
+        
+        new_article = TestArticle.objects.get(id=article.id)
+        # Counting and ids don't decode the values
+        self.assertEqual(new_article.tags.count(), 2)
+        self.assertEqual(new_article.tags.ids(), [ObjectId(tag1.id), ObjectId(tag2.id)])
+        self.assertTrue(tag2 in new_article.tags)
+        self.assertEqual(new_article.categories.count(), 1)
+        self.assertTrue(new_article.tags._objects is None)
+        # Accessing one embedded object only decodes that one
+        self.assertEqual(new_article.tags.all()[1].name, 'test tag 2')
+        self.assertTrue(new_article.tags.objects[0]._raw is not None)
+        self.assertTrue(new_article.tags.objects[1]._raw is None)
+        self.assertEqual([tag.name for tag in new_article.tags.all()], ['test tag 1', 'test tag 2'])
+    
+    def test_shared_objects(self):
+        """
+        Test that query sets keep their objects when the manager is modified.
+        """
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        category2 = TestCategory(title='test cat 2')
+        category2.save()
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=category1)
+        article.categories.add(category1)
+        categories = article.categories.all()
+        article.categories.add(category2)
+        self.assertEqual([cat.title for cat in categories], ['test cat 1'])
+        self.assertEqual([cat.title for cat in article.categories.all()], ['test cat 1', 'test cat 2'])
+        categories = article.categories.all()
+        shared = categories.objects
+        article.categories.remove(category1)
+        # The shared list is left alone and the manager gets the rebuilt one
+        self.assertTrue(categories.objects is shared)
+        self.assertFalse(article.categories.objects is shared)
+        self.assertEqual([cat.title for cat in categories], ['test cat 1', 'test cat 2'])
+        self.assertFalse(category1 in article.categories)
+        self.assertEqual([cat.title for cat in article.categories.objs()], ['test cat 2'])
+    
+    def test_embedded_fields(self):
+        """
+        Test embedding only some fields of the related objects.
+        """
+        author1 = TestWriter(name='test author 1', bio='long bio 1')
+        author1.save()
+        author2 = TestWriter(name='test author 2', bio='long bio 2')
+        author2.save()
+        anthology = TestAnthology(title='test anthology')
+        anthology.authors.add(author1, author2)
+        anthology.save()
+        
+        # Only the listed fields are stored
+        data = connections['default'].get_collection(TestAnthology._meta.db_table).find_one({'_id':ObjectId(anthology.id)})
+        self.assertEqual(data['authors'], [{'id':ObjectId(author1.id), 'name':'test author 1'}, {'id':ObjectId(author2.id), 'name':'test author 2'}])
+        
+        new_anthology = TestAnthology.objects.get(id=anthology.id)
+        authors = list(new_anthology.authors.all())
+        self.assertEqual([author.name for author in authors], ['test author 1', 'test author 2'])
+        self.assertIsInstance(authors[0], TestWriter)
+        self.assertEqual(authors[0].id, author1.id)
+        # The other fields are loaded when accessed
+        self.assertEqual(authors[1].bio, 'long bio 2')
+        # The embedded fields are used for filtering
+        self.assertEqual([author.name for author in new_anthology.authors.all().filter(name='test author 2')], ['test author 2'])
+        self.assertEqual([author.name for author in new_anthology.authors.all().filter(bio='long bio 1')], ['test author 1'])
+    
+    def test_embed_added_ids(self):
+        """
+        Test saving embedded relations that were added as ids only.
+        """
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        tag1 = TestTag(name='test tag 1')
+        tag1.save()
+        tag2 = TestTag(name='test tag 2')
+        tag2.save()
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=category1)
+        article.tags.add(tag1.id, ObjectId(tag2.id))
+        article.save()
+        self.assertEqual([tag.name for tag in TestArticle.objects.get(id=article.id).tags.all()], ['test tag 1', 'test tag 2'])
+        
+        # All the missing ids are reported at once
+        missing1, missing2 = ObjectId(), ObjectId()
+        article.tags.add(missing1, tag1, missing2)
+        try:
+            article.save()
+        except TestTag.DoesNotExist, e:
+            self.assertTrue(str(missing1) in str(e))
+            self.assertTrue(str(missing2) in str(e))
+        else:
+            self.fail('DoesNotExist not raised')
+    
+    def test_identity_map(self):
+        """
+        Test sharing the related instances within an identity map.
+        """
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        category2 = TestCategory(title='test cat 2')
+        category2.save()
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=category1)
+        article.categories.add(category2)
+        article.save()
+        article2 = TestArticle(title='test article 2', text='test article 2 text', main_category=category1)
+        article2.categories.add(category2)
+        article2.save()
+        
+        with identity_map():
+            articles = list(TestArticle.objects.all().order_by('title'))
+            first = articles[0].categories.all()[0]
+            # The instance is not loaded again
+            TestCategory.objects.filter(id=category2.id).update(title='changed')
+            self.assertTrue(list(articles[1].categories.all())[0] is first)
+            self.assertEqual(first.title, 'test cat 2')
+            # Saving removes it from the map
+            first.save()
+            TestCategory.objects.filter(id=category2.id).update(title='changed')
+            self.assertEqual(TestArticle.objects.get(id=article.id).categories.all()[0].title, 'changed')
+        # Without an identity map the instances are loaded separately
+        self.assertFalse(articles[0].categories.objs()[0] is articles[1].categories.objs()[0])
+        
+        # Least recently used instances are evicted
+        objects = IdentityMap(max_size=2)
+        objects.add(TestCategory, category1)
+        objects.add(TestCategory, category2)
+        self.assertTrue(objects.get(TestCategory, category1.id) is category1)
+        objects.add(TestTag, TestTag(id=category1.id))
+        self.assertEqual(len(objects), 2)
+        self.assertTrue(objects.get(TestCategory, category2.id) is None)
+        self.assertTrue(objects.get(TestCategory, category1.id) is category1)
+    
+    def test_related_cache(self):
+        """
+        Test loading the related objects from the second-level cache.
+        """
+        field = TestMenu._meta.get_field('categories')
+        cache = field.related_cache
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        category2 = TestCategory(title='test cat 2')
+        category2.save()
+        menu = TestMenu(title='test menu 1')
+        menu.categories.add(category1, category2)
+        menu.save()
+        
+        cache.reset_stats()
+        self.assertEqual([c.title for c in TestMenu.objects.get(id=menu.id).categories.all()], ['test cat 1', 'test cat 2'])
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        # The second time the objects come from the cache, even if changed behind its back
+        TestCategory.objects.filter(id=category1.id).update(title='changed')
+        self.assertEqual([c.title for c in TestMenu.objects.get(id=menu.id).categories.all()], ['test cat 1', 'test cat 2'])
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        
+        # Saving and deleting remove the objects from the cache
+        category2.title = 'test cat 2 changed'
+        category2.save()
+        self.assertEqual([c.title for c in TestMenu.objects.get(id=menu.id).categories.all()], ['test cat 1', 'test cat 2 changed'])
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        category2.delete()
+        with track_relations() as tracker:
+            self.assertEqual([c.title for c in TestMenu.objects.get(id=menu.id).categories.objs(missing=MISSING_SKIP)], ['test cat 1'])
+        self.assertEqual((cache.hits, cache.misses), (4, 4))
+        self.assertEqual((tracker[field].cache_hits, tracker[field].queries), (1, 1))
+        
+        # Relations without a cache don't use one
+        self.assertEqual(TestArticle._meta.get_field('categories').related_cache, None)
+    
+    def test_reverse_paging(self):
+        """
+        Test counting and paging reverse relations in MongoDB.
+        """
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        category2 = TestCategory(title='test cat 2')
+        category2.save()
+        for i in xrange(5):
+            article = TestArticle(title='test article %d' % i, text='test article text', main_category=category1)
+            article.categories.add(category1)
+            article.save()
+        
+        self.assertEqual(category1.testarticle_set.count(), 5)
+        self.assertTrue(category1.testarticle_set.exists())
+        self.assertEqual(category2.testarticle_set.count(), 0)
+        self.assertFalse(category2.testarticle_set.exists())
+        # Slices and batches are in pk order, i.e. creation order here
+        self.assertEqual([a.title for a in category1.testarticle_set[1:3]], ['test article 1', 'test article 2'])
+        self.assertEqual(category1.testarticle_set[4].title, 'test article 4')
+        self.assertEqual([a.title for a in category1.testarticle_set.iterator(chunk_size=2)], ['test article %d' % i for i in xrange(5)])
+        self.assertEqual(list(category2.testarticle_set.iterator(chunk_size=2)), [])
+        
+        # The relationship query set loads only the page it's sliced to
+        queryset = TestArticle.categories.through.objects.filter(testcategory=category1)
+        self.assertEqual(len(queryset), 5)
+        page = list(queryset[3:5])
+        self.assertEqual([r.testarticle.title for r in page], ['test article 3', 'test article 4'])
+        self.assertTrue(all(r.testcategory is category1 for r in page))
+        self.assertEqual(len(list(queryset)), 5)
+        # Iterating continues from the last pk of each batch instead of slicing, 2 + 2 + 1 objects and then all 5
+        queryset = TestArticle.categories.through.objects.filter(testcategory=category1)
+        with count_queries() as counter:
+            self.assertEqual([r.testarticle.title for r in queryset.iterator(chunk_size=2)], ['test article %d' % i for i in xrange(5)])
+            self.assertEqual([r.testarticle.title for r in queryset], ['test article %d' % i for i in xrange(5)])
+        self.assertEqual(counter.queries, 4)
+    
+    def test_relation_counts(self):
+        """
+        Test counting the references to each related object with an aggregation.
+        """
+        category = TestCategory(title='test cat 1')
+        category.save()
+        tag1 = TestTag(name='test tag 1')
+        tag1.save()
+        tag2 = TestTag(name='test tag 2')
+        tag2.save()
+        tag3 = TestTag(name='test tag 3')
+        tag3.save()
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=category)
+        article.tags.add(tag1, tag2)
+        article.categories.add(category)
+        article.save()
+        article = TestArticle(title='test article 2', text='test article 2 text', main_category=category)
+        article.tags.add(tag1)
+        article.save()
+        
+        # Embedded and non-embedded relations give the same results
+        self.assertEqual(TestArticle.tags.counts(), {tag1.pk:2, tag2.pk:1})
+        self.assertEqual(TestArticle.categories.counts(), {category.pk:1})
+        self.assertEqual(TestArticle.tags.counts({'title':'test article 2'}), {tag1.pk:1})
+        self.assertEqual(TestArticle.tags.counts(fields=['name']), {tag1.pk:{'count':2, 'name':'test tag 1'}, tag2.pk:{'count':1, 'name':'test tag 2'}})
+        self.assertEqual(TestArticle.categories.counts(fields=['title']), {category.pk:{'count':1, 'title':'test cat 1'}})
+        
+        # Bare ObjectIds of migrated data are counted, and their fields are loaded
+        collection = connections['default'].get_collection(TestArticle._meta.db_table)
+        collection.update({'_id':ObjectId(article.pk)}, {'$set':{'tags':[ObjectId(tag1.pk), str(tag3.pk)], 'categories':[ObjectId(category.pk)]}})
+        self.assertEqual(TestArticle.tags.counts(), {tag1.pk:2, tag2.pk:1, tag3.pk:1})
+        self.assertEqual(TestArticle.categories.counts(), {category.pk:2})
+        self.assertEqual(TestArticle.tags.counts({'title':'test article 2'}, fields=['name']), {tag1.pk:{'count':1, 'name':'test tag 1'}, tag3.pk:{'count':1, 'name':'test tag 3'}})
+    
+    def test_through_lookup(self):
+        """
+        Test looking up relationship instances of the through model directly.
+        """
+        through = TestArticle.categories.through
+        self.assertFalse(through.objects.all().exists())
+        self.assertEqual(len(through.objects.all()), 0)
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        category2 = TestCategory(title='test cat 2')
+        category2.save()
+        article1 = TestArticle(title='test article 1', text='test article 1 text', main_category=category1)
+        article1.categories.add(category1, category2)
+        article1.save()
+        article2 = TestArticle(title='test article 2', text='test article 2 text', main_category=category1)
+        article2.categories.add(category2)
+        article2.save()
+        
+        relationship = through.objects.get(pk='%s$f$%s' % (article1.pk, category2.pk))
+        self.assertEqual(relationship.testarticle.title, 'test article 1')
+        self.assertEqual(relationship.testcategory.title, 'test cat 2')
+        relationship = through.objects.get(pk='%s$r$%s' % (category2.pk, article2.pk))
+        self.assertEqual(relationship.pk, '%s$r$%s' % (category2.pk, article2.pk))
+        self.assertEqual(relationship.testarticle.title, 'test article 2')
+        self.assertRaises(through.DoesNotExist, through.objects.get, pk='%s$f$%s' % (article2.pk, category1.pk))
+        
+        self.assertTrue(through.objects.all().exists())
+        self.assertEqual(len(through.objects.all()), 3)
+        self.assertEqual([(r.testarticle.title, r.testcategory.title) for r in through.objects.all()[1:3]], [('test article 1', 'test cat 2'), ('test article 2', 'test cat 2')])
+        self.assertEqual(through.objects.all()[0].testcategory.title, 'test cat 1')
+        
+        # Lists of bare ObjectIds and strings from migrated data are found too
+        collection = connections['default'].get_collection(TestArticle._meta.db_table)
+        collection.update({'_id':ObjectId(article2.pk)}, {'$set':{'categories':[ObjectId(category1.pk), str(category2.pk)]}})
+        relationship = through.objects.get(pk='%s$f$%s' % (article2.pk, category1.pk))
+        self.assertEqual(relationship.testcategory.title, 'test cat 1')
+        relationship = through.objects.get(pk='%s$r$%s' % (category2.pk, article2.pk))
+        self.assertEqual(relationship.testarticle.title, 'test article 2')
+        self.assertEqual(len(through.objects.all()), 4)
+        self.assertEqual([(r.testarticle.title, r.testcategory.title) for r in through.objects.all()[2:4]], [('test article 2', 'test cat 1'), ('test article 2', 'test cat 2')])
+    
+    def test_bulk_update(self):
+        """
+        Test adding and removing related objects of many instances at once.
+        """
+        category = TestCategory(title='test cat 1')
+        category.save()
+        tag1 = TestTag(name='test tag 1')
+        tag1.save()
+        tag2 = TestTag(name='test tag 2')
+        tag2.save()
+        for i in xrange(3):
+            article = TestArticle(title='test article %d' % i, text='test article text', main_category=category)
+            article.tags.add(tag1)
+            article.save()
+        
+        calls = []
+        def on_change(sender, instance, action, reverse, model, pk_set, parent_pk_set=None, **kwargs):
+            calls.append((action, instance, list(pk_set), len(parent_pk_set)))
+        # The stored copies of tag1 are outdated, but it's not added again
+        tag1.name = 'renamed tag 1'
+        tag1.save()
+        m2m_changed.connect(on_change)
+        try:
+            TestArticle.tags.bulk_add(TestArticle.objects.filter(title__in=['test article 0', 'test article 1']), tag1, tag2)
+            self.assertEqual(calls, [('pre_add', None, [tag1.pk, tag2.pk], 2), ('post_add', None, [tag1.pk, tag2.pk], 2)])
+            articles = list(TestArticle.objects.all().order_by('title'))
+            self.assertEqual([list(a.tags.ids()) for a in articles], [[ObjectId(tag1.pk), ObjectId(tag2.pk)]] * 2 + [[ObjectId(tag1.pk)]])
+            # The embedded copies are complete
+            self.assertEqual(articles[0].tags.all()[1].name, 'test tag 2')
+            
+            del calls[:]
+            TestArticle.tags.bulk_remove([a.pk for a in articles], tag1)
+            self.assertEqual([c[0] for c in calls], ['pre_remove', 'post_remove'])
+            self.assertEqual([list(a.tags.ids()) for a in TestArticle.objects.all().order_by('title')], [[ObjectId(tag2.pk)]] * 2 + [[]])
+        finally:
+            m2m_changed.disconnect(on_change)
+    
+    def test_set(self):
+        """
+        Test replacing the related objects with set().
+        """
+        category = TestCategory(title='test cat 1')
+        category.save()
+        tags = []
+        for i in xrange(4):
+            tag = TestTag(name='test tag %d' % i)
+            tag.save()
+            tags.append(tag)
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=category)
+        article.tags.add(tags[0], tags[1], tags[2])
+        article.save()
+        
+        article = TestArticle.objects.get(id=article.id)
+        unchanged = article.tags.all()[1]
+        calls = []
+        def on_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+            calls.append((action, sorted(pk_set)))
+        m2m_changed.connect(on_change)
+        try:
+            article.tags.set([tags[1], tags[2].pk, tags[3]])
+            article.tags.set([tags[1], tags[2], tags[3]])
+        finally:
+            m2m_changed.disconnect(on_change)
+        # Signals are only sent for the difference
+        self.assertEqual(calls, [('pre_remove', [tags[0].pk]), ('post_remove', [tags[0].pk]), ('pre_add', [tags[3].pk]), ('post_add', [tags[3].pk])])
+        self.assertTrue(article.tags.all()[0] is unchanged)
+        article.tags.commit()
+        self.assertEqual([t.name for t in TestArticle.objects.get(id=article.id).tags.all()], ['test tag 1', 'test tag 2', 'test tag 3'])
+    
+    def test_iterator(self):
+        """
+        Test iterating over relations without keeping the instances.
+        """
+        category = TestCategory(title='test cat 1')
+        category.save()
+        tags = []
+        categories = []
+        for i in xrange(5):
+            tag = TestTag(name='test tag %d' % i)
+            tag.save()
+            tags.append(tag)
+            category = TestCategory(title='test cat %d' % i)
+            category.save()
+            categories.append(category)
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=category)
+        article.tags.add(*tags)
+        article.categories.add(*categories)
+        article.save()
+        
+        article = TestArticle.objects.get(id=article.id)
+        self.assertEqual([c.title for c in article.categories.iterator(chunk_size=2)], ['test cat %d' % i for i in xrange(5)])
+        self.assertEqual([t.name for t in article.tags.iterator(chunk_size=2)], ['test tag %d' % i for i in xrange(5)])
+        # Nothing was kept in the manager
+        self.assertFalse(any(obj.obj for obj in article.categories.objects))
+        self.assertFalse(any(obj._obj for obj in article.tags.objects))
+        categories[1].delete()
+        self.assertEqual(len(list(article.categories.iterator(missing=MISSING_SKIP))), 4)
+        self.assertRaises(TestCategory.DoesNotExist, list, article.categories.iterator())
+    
+    def test_instrumentation(self):
+        """
+        Test counting the relation loads and detecting one by one loading.
+        """
+        categories_field = TestArticle._meta.get_field('categories')
+        tags_field = TestArticle._meta.get_field('tags')
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        category2 = TestCategory(title='test cat 2')
+        category2.save()
+        tag = TestTag(name='test tag 1')
+        tag.save()
+        for i in xrange(3):
+            article = TestArticle(title='test article %d' % i, text='test article text', main_category=category1)
+            article.categories.add(category1 if i < 2 else category2)
+            article.tags.add(tag)
+            article.save()
+        
+        loads = []
+        def on_load(sender, field, pks, single, **kwargs):
+            loads.append((field, single))
+        relation_post_load.connect(on_load)
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                with track_relations(max_single_loads=2) as tracker:
+                    for article in TestArticle.objects.all():
+                        article.categories.all()[0]
+                        list(article.tags.all())
+        finally:
+            relation_post_load.disconnect(on_load)
+        stats = tracker[categories_field]
+        self.assertEqual((stats.queries, stats.documents, stats.cache_hits, stats.single_loads), (3, 3, 0, 3))
+        self.assertEqual(loads, [(categories_field, True)] * 3)
+        self.assertEqual(tracker[tags_field].queries, 0)
+        self.assertTrue(tracker[tags_field].decode_time > 0)
+        self.assertEqual(tracker.totals().queries, 3)
+        self.assertTrue('mongom2m_testapp.TestArticle.categories: 3 queries' in tracker.report())
+        self.assertEqual([w.category for w in caught], [RelationLoadWarning])
+        
+        # Loading in chunks is not a problem
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            with track_relations(max_single_loads=2) as tracker:
+                prefetch_m2m(TestArticle.objects.all(), 'categories')
+        self.assertEqual(tracker[categories_field].single_loads, 0)
+        self.assertEqual(caught, [])
+        
+        # Reverse query sets and filtered relations count their queries too
+        article = TestArticle.objects.get(title='test article 0')
+        with track_relations() as tracker:
+            self.assertEqual(sorted(a.title for a in category1.testarticle_set.all()), ['test article 0', 'test article 1'])
+            self.assertEqual(category1.testarticle_set.all().filter(title='test article 1').count(), 1)
+            self.assertEqual([c.title for c in article.categories.all().filter(title='test cat 1')], ['test cat 1'])
+        # The filter finds the matching ids, then the match is loaded when iterated
+        stats = tracker[categories_field]
+        self.assertEqual((stats.queries, stats.documents), (4, 4))
+    
+    def test_benchmarks(self):
+        """
+        Test that the benchmark suite runs and counts the queries.
+        """
+        from benchmarks import run_benchmarks, QueryCounter
+        with QueryCounter() as counter:
+            TestCategory(title='test cat 1').save()
+            list(TestCategory.objects.all())
+        self.assertEqual(counter.queries, 2)
+        results = run_benchmarks(sizes=(10,), db_sizes=(5,), number=1)
+        self.assertEqual(sorted(results['manager']['10']), ['add', 'contains', 'remove'])
+        self.assertEqual(sorted(results['conversion']['10']), ['embed', 'no_embed'])
+        self.assertEqual(results['queries']['5']['forward_iteration_embed']['queries'], 1)
+        self.assertEqual(results['manager']['10']['add']['queries'], 0)
+        # The benchmark data is deleted
+        self.assertEqual(TestArticle.objects.count(), 0)
+    
+    def test_use_mongomock(self):
+        """
+        Test running the models against an in-memory mongomock database.
+        """
+        import mongomock
+        from benchmarks import use_mongomock
+        default = connections['default']
+        connection = default.__class__(dict(default.settings_dict), alias='default')
+        use_mongomock(connection)
+        self.assertTrue(isinstance(connection.connection, mongomock.MongoClient))
+        connections._connections['default'] = connection
+        try:
+            category = TestCategory(title='test cat 1')
+            category.save()
+            article = TestArticle(title='test article 1', text='test article 1 text', main_category=category)
+            article.categories.add(category)
+            article.save()
+            article = TestArticle.objects.get(pk=article.pk)
+            self.assertEqual([c.title for c in article.categories.all()], ['test cat 1'])
+            self.assertEqual(list(category.testarticle_set.values_list('title', flat=True)), ['test article 1'])
+            # The PyMongo 2 arguments are accepted
+            collection = connection.get_collection(TestArticle._meta.db_table)
+            collection.update({'_id':ObjectId(article.pk)}, {'$set':{'text':'changed'}}, safe=True, multi=True)
+            self.assertEqual(collection.find_one({'_id':ObjectId(article.pk)}, fields=['text'])['text'], 'changed')
+            TestArticle.objects.all().delete()
+            TestCategory.objects.all().delete()
+        finally:
+            connections._connections['default'] = default
+    
+    def test_overflow(self):
+        """
+        Test storing the objects beyond overflow_threshold in the overflow collection.
+        """
+        field = TestTagSet._meta.get_field('tags')
+        tags = []
+        for i in xrange(5):
+            tag = TestTag(name='test tag %d' % i)
+            tag.save()
+            tags.append(tag)
+        tag_set = TestTagSet(name='test set 1')
+        tag_set.tags.add(*tags)
+        tag_set.save()
+        # The document has 3 objects and the overflow marker
+        document = connections['default'].get_collection(TestTagSet._meta.db_table).find_one({'_id':ObjectId(tag_set.pk)})
+        self.assertEqual(len(document['tags']), 4)
+        self.assertEqual(field.overflow_collection().find({'parent':ObjectId(tag_set.pk)}).count(), 2)
+        
+        # Counting and membership tests don't load the overflow
+        tag_set = TestTagSet.objects.get(id=tag_set.id)
+        self.assertEqual(tag_set.tags.count(), 5)
+        self.assertTrue(tags[4] in tag_set.tags)
+        self.assertFalse(TestTag(id=str(ObjectId())) in tag_set.tags)
+        self.assertTrue(tag_set.tags._overflow_unloaded)
+        self.assertEqual([t.name for t in tag_set.tags.all()], ['test tag %d' % i for i in xrange(5)])
+        # Saving without loading the overflow keeps it
+        tag_set = TestTagSet.objects.get(id=tag_set.id)
+        tag_set.name = 'test set 1 changed'
+        tag_set.save()
+        self.assertEqual(TestTagSet.objects.get(id=tag_set.id).tags.count(), 5)
+        
+        # Reverse queries and counts include the overflow
+        self.assertEqual(tags[4].tag_sets.count(), 1)
+        self.assertEqual(tags[4].tag_sets.all()[0].name, 'test set 1 changed')
+        self.assertEqual(TestTagSet.tags.counts()[tags[4].pk], 1)
+        
+        tag_set.tags.remove(tags[4])
+        tag_set.tags.commit()
+        self.assertEqual([t.name for t in TestTagSet.objects.get(id=tag_set.id).tags.all()], ['test tag %d' % i for i in xrange(4)])
+        self.assertEqual(tags[4].tag_sets.count(), 0)
+        # Shrinking below the threshold empties the overflow
+        tag_set = TestTagSet.objects.get(id=tag_set.id)
+        tag_set.tags.remove(tags[0], tags[1])
+        tag_set.save()
+        self.assertEqual(field.overflow_collection().find({'parent':ObjectId(tag_set.pk)}).count(), 0)
+        self.assertEqual([t.name for t in TestTagSet.objects.get(id=tag_set.id).tags.all()], ['test tag 2', 'test tag 3'])
+        tag_set.tags.add(tags[0], tags[1], tags[4])
+        tag_set.save()
+        pk = ObjectId(tag_set.pk)
+        self.assertEqual(field.overflow_collection().find({'parent':pk}).count(), 2)
+        tag_set.delete()
+        self.assertEqual(field.overflow_collection().find({'parent':pk}).count(), 0)
+    
+    def test_overflow_updates(self):
+        """
+        Test that commits, through model saves and bulk updates add the objects
+        beyond overflow_threshold to the overflow without loading it.
+        """
+        field = TestTagSet._meta.get_field('tags')
+        db_collection = connections['default'].get_collection(TestTagSet._meta.db_table)
+        # The overflow collection has no model, so it isn't flushed between tests
+        field.overflow_collection().remove()
+        tags = []
+        for i in xrange(8):
+            tag = TestTag(name='test tag %d' % i)
+            tag.save()
+            tags.append(tag)
+        tag_set = TestTagSet(name='test set 1')
+        tag_set.tags.add(*tags[:2])
+        tag_set.save()
+        
+        # Commits fill the document up to the threshold and the rest goes to the overflow
+        tag_set = TestTagSet.objects.get(pk=tag_set.pk)
+        tag_set.tags.add(tags[2], tags[3])
+        tag_set.tags.commit()
+        self.assertEqual(len(db_collection.find_one({'_id':ObjectId(tag_set.pk)})['tags']), 4)
+        self.assertEqual([row['related'] for row in field.overflow_collection().find({'parent':ObjectId(tag_set.pk)})], [ObjectId(tags[3].pk)])
+        self.assertEqual(tag_set.tag_count, 4)
+        
+        # Adding and removing while the overflow isn't loaded only queries the objects involved
+        tag_set = TestTagSet.objects.get(pk=tag_set.pk)
+        tag_set.tags.add(tags[3], tags[4])
+        tag_set.tags.remove(tags[0], tags[3])
+        self.assertTrue(tag_set.tags._overflow_unloaded)
+        self.assertEqual(tag_set.tags.count(), 3)
+        tag_set.tags.commit()
+        self.assertEqual(len(db_collection.find_one({'_id':ObjectId(tag_set.pk)})['tags']), 3)
+        self.assertEqual([t.name for t in TestTagSet.objects.get(pk=tag_set.pk).tags.all()], ['test tag 1', 'test tag 2', 'test tag 4'])
+        self.assertEqual(TestTagSet.objects.get(pk=tag_set.pk).tag_count, 3)
+        
+        # The through model commits into the overflow as well
+        TestTagSet.tags.through(**{'testtagset':tag_set, 'testtag':tags[5]}).save()
+        tag_set = TestTagSet.objects.get(pk=tag_set.pk)
+        self.assertEqual(len(db_collection.find_one({'_id':ObjectId(tag_set.pk)})['tags']), 3)
+        self.assertEqual([t.name for t in tag_set.tags.all()], ['test tag 1', 'test tag 2', 'test tag 4', 'test tag 5'])
+        
+        # Saving without loading the overflow writes the added and removed objects to it
+        tag_set = TestTagSet.objects.get(pk=tag_set.pk)
+        tag_set.tags.remove(tags[4])
+        tag_set.tags.add(tags[6])
+        tag_set.save()
+        self.assertEqual([row['related'] for row in field.overflow_collection().find({'parent':ObjectId(tag_set.pk)}).sort('position', 1)], [ObjectId(tags[5].pk), ObjectId(tags[6].pk)])
+        tag_set = TestTagSet.objects.get(pk=tag_set.pk)
+        self.assertEqual([t.name for t in tag_set.tags.all()], ['test tag 1', 'test tag 2', 'test tag 5', 'test tag 6'])
+        self.assertEqual(tag_set.tag_count, 4)
+        
+        # Bulk adds skip the objects already in the overflow and overflow the other sets
+        other = TestTagSet(name='test set 2')
+        other.tags.add(tags[0])
+        other.save()
+        TestTagSet.tags.bulk_add([tag_set, other], tags[5], tags[6], tags[7])
+        tag_set = TestTagSet.objects.get(pk=tag_set.pk)
+        self.assertEqual([t.name for t in tag_set.tags.all()], ['test tag 1', 'test tag 2', 'test tag 5', 'test tag 6', 'test tag 7'])
+        self.assertEqual(tag_set.tag_count, 5)
+        other = TestTagSet.objects.get(pk=other.pk)
+        self.assertEqual(len(db_collection.find_one({'_id':ObjectId(other.pk)})['tags']), 4)
+        self.assertEqual([t.name for t in other.tags.all()], ['test tag 0', 'test tag 5', 'test tag 6', 'test tag 7'])
+        self.assertEqual(other.tag_count, 4)
+        TestTagSet.tags.bulk_remove([tag_set, other], tags[7])
+        self.assertEqual(TestTagSet.objects.get(pk=other.pk).tags.count(), 3)
+        self.assertEqual(TestTagSet.objects.get(pk=other.pk).tag_count, 3)
+        
+        # Streaming the relation reads the overflow in pages without keeping it
+        tag_set = TestTagSet.objects.get(pk=tag_set.pk)
+        self.assertEqual([t.name for t in tag_set.tags.iterator(chunk_size=2)], ['test tag 1', 'test tag 2', 'test tag 5', 'test tag 6'])
+        self.assertTrue(tag_set.tags._overflow_unloaded)
+        self.assertEqual([obj.pk for obj in tag_set.tags._objects], [ObjectId(tags[1].pk), ObjectId(tags[2].pk)])
+        
+        # The through model lists the stored lists, then the overflows
+        through = TestTagSet.tags.through
+        self.assertTrue(through.objects.all().exists())
+        self.assertEqual(len(through.objects.all()), 7)
+        relationships = [(r.testtagset.name, r.testtag.name) for r in through.objects.all()[0:7]]
+        self.assertEqual(sorted(relationships), sorted([('test set 1', 'test tag %d' % i) for i in (1, 2, 5, 6)] + [('test set 2', 'test tag %d' % i) for i in (0, 5, 6)]))
+        self.assertEqual([(r.testtagset.name, r.testtag.name) for r in through.objects.all()[5:7]], relationships[5:7])
+        self.assertEqual(through.objects.all()[6].testtag.name, relationships[6][1])
+    
+    def test_prefetch_reverse(self):
+        """
+        Test loading reverse relations of many instances at once.
+        """
+        categories = []
+        for i in xrange(3):
+            category = TestCategory(title='test cat %d' % i)
+            category.save()
+            categories.append(category)
+        for i in xrange(3):
+            article = TestArticle(title='test article %d' % i, text='test article text', main_category=categories[0])
+            article.categories.add(*categories[:i + 1])
+            article.save()
+        
+        with count_queries() as counter:
+            prefetched = prefetch_reverse(TestCategory.objects.all().order_by('title'), 'testarticle_set', fields=['title'])
+            self.assertEqual([sorted(a.title for a in c.testarticle_set.all()) for c in prefetched], [
+                ['test article 0', 'test article 1', 'test article 2'], ['test article 1', 'test article 2'], ['test article 2']])
+            self.assertEqual([c.testarticle_set.count() for c in prefetched], [3, 2, 1])
+        # One query for the categories and one for the articles
+        self.assertEqual(counter.queries, 2)
+        # Filtering queries again
+        self.assertEqual(prefetched[1].testarticle_set.all().filter(title='test article 1').count(), 1)
+        
+        with count_queries() as counter:
+            prefetched = prefetch_reverse(categories, 'testarticle_set', counts_only=True)
+            self.assertEqual([c.testarticle_set.count() for c in prefetched], [3, 2, 1])
+            self.assertTrue(prefetched[2].testarticle_set.exists())
+        self.assertEqual(counter.queries, 1)
+    
+    def test_values(self):
+        """
+        Test getting field values of related objects without loading whole instances.
+        """
+        category1 = TestCategory(title='test cat 1')
+        category1.save()
+        category2 = TestCategory(title='test cat 2')
+        category2.save()
+        author1 = TestWriter(name='test author 1', bio='test bio 1')
+        author1.save()
+        author2 = TestWriter(name='test author 2', bio='test bio 2')
+        author2.save()
+        article = TestArticle(title='test article 1', text='test article 1 text', main_category=category1)
+        article.categories.add(category2, category1)
+        article.save()
+        anthology = TestAnthology(title='test anthology 1')
+        anthology.authors.add(author2, author1)
+        anthology.save()
+        
+        article = TestArticle.objects.get(id=article.id)
+        anthology = TestAnthology.objects.get(id=anthology.id)
+        with count_queries() as counter:
+            # Ids and embedded values don't need queries
+            self.assertEqual(article.categories.all().values_list('pk', flat=True), [category2.pk, category1.pk])
+            self.assertEqual(anthology.authors.all().values_list('id', 'name'), [(author2.pk, 'test author 2'), (author1.pk, 'test author 1')])
+            self.assertEqual(counter.queries, 0)
+            # Fields that aren't embedded are queried in the stored order
+            self.assertEqual(article.categories.all().values('title'), [{'title':'test cat 2'}, {'title':'test cat 1'}])
+            self.assertEqual(anthology.authors.all().values_list('bio', flat=True), ['test bio 2', 'test bio 1'])
+            self.assertEqual(counter.queries, 2)
+        # Nothing was loaded
+        self.assertFalse(any(obj.obj for obj in article.categories.objects))
+        
+        authors = list(anthology.authors.objs().only('name'))
+        self.assertEqual([a.name for a in authors], ['test author 2', 'test author 1'])
+        self.assertTrue(isinstance(authors[0].__class__.__dict__.get('bio'), DeferredAttribute))
+        self.assertEqual(anthology.authors.objs().defer('bio')[1].name, 'test author 1')
+        
+        self.assertEqual(list(category1.testarticle_set.values_list('pk', flat=True)), [article.pk])
+        self.assertEqual(list(category1.testarticle_set.values('title')), [{'title':'test article 1'}])
+        self.assertEqual([a.title for a in category1.testarticle_set.only('title')], ['test article 1'])
+        self.assertEqual([a.title for a in category1.testarticle_set.defer('text')], ['test article 1'])
+        
+        # Foreign keys are given by attname by default, and can be requested by name or attname
+        issue = TestIssue(title='test issue 1')
+        issue.articles.add(article)
+        issue.save()
+        attnames = set(field.attname for field in TestArticle._meta.fields)
+        values = issue.articles.all().values()[0]
+        self.assertEqual(set(values), attnames)
+        self.assertEqual((values['title'], values['main_category_id']), ('test article 1', category1.pk))
+        issue = TestIssue.objects.get(id=issue.id)
+        values = issue.articles.all().values()[0]
+        self.assertEqual(set(values), attnames)
+        self.assertEqual((values['title'], values['main_category_id']), ('test article 1', category1.pk))
+        self.assertEqual(issue.articles.all().values_list('main_category', flat=True), [category1.pk])
+        self.assertEqual(issue.articles.all().values_list('main_category_id', 'title'), [(category1.pk, 'test article 1')])
+    
+    def test_count_field(self):
+        """
+        Test that the count_field is kept up to date by saves, commits and bulk updates
+        """
+        tags = [TestTag(name='test tag %d' % i) for i in xrange(6)]
+        for tag in tags:
+            tag.save()
+        small = TestTagSet(name='small')
+        small.tags.add(tags[0])
+        small.save()
+        large = TestTagSet(name='large')
+        large.tags.add(*tags[:5])
+        large.save()
+        self.assertEqual(large.tag_count, 5)
+        self.assertEqual([s.name for s in TestTagSet.objects.order_by('-tag_count')], ['large', 'small'])
+        self.assertEqual([s.name for s in TestTagSet.objects.filter(tag_count__gte=2)], ['large'])
+        
+        # Committed changes update the counter, also for objects in the overflow
+        large = TestTagSet.objects.get(pk=large.pk)
+        large.tags.remove(tags[0], tags[4])
+        large.tags.add(tags[5])
+        large.tags.commit()
+        self.assertEqual(large.tag_count, 4)
+        self.assertEqual(TestTagSet.objects.get(pk=large.pk).tag_count, 4)
+        small.tags.clear()
+        small.tags.commit()
+        self.assertEqual(TestTagSet.objects.get(pk=small.pk).tag_count, 0)
+        
+        # Bulk updates only count the objects that were added or removed
+        TestTagSet.tags.bulk_add([small, large], tags[0], tags[1])
+        self.assertEqual(TestTagSet.objects.get(pk=small.pk).tag_count, 2)
+        self.assertEqual(TestTagSet.objects.get(pk=large.pk).tag_count, 5)
+        TestTagSet.tags.bulk_remove([small, large], tags[1], tags[5])
+        self.assertEqual(TestTagSet.objects.get(pk=small.pk).tag_count, 1)
+        large = TestTagSet.objects.get(pk=large.pk)
+        self.assertEqual(large.tag_count, 3)
+        self.assertEqual(large.tags.count(), 3)
+        
+        # Deleted related objects are pulled with the counter
+        TestTagSet._meta.get_field('tags').resync_embedded(deleted=[tags[0].pk])
+        self.assertEqual(TestTagSet.objects.get(pk=small.pk).tag_count, 0)
+        self.assertEqual(TestTagSet.objects.get(pk=large.pk).tag_count, 2)
         
+        # Bare ObjectIds from migrated data are pulled with the counter too
+        collection = connections['default'].get_collection(TestTagSet._meta.db_table)
+        collection.update({'_id':ObjectId(small.pk)}, {'$set':{'tags':[ObjectId(tags[1].pk), str(tags[2].pk)], 'tag_count':2}})
+        TestTagSet.tags.bulk_remove([small], tags[1], tags[2])
+        self.assertEqual(collection.find_one({'_id':ObjectId(small.pk)})['tags'], [])
+        self.assertEqual(TestTagSet.objects.get(pk=small.pk).tag_count, 0)
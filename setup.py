@@ -5,7 +5,7 @@ setup(
     version='0.1.0',
     author=u'Kenneth Falck',
     author_email='kennu@iki.fi',
-    packages=['mongom2m', 'mongom2m_testapp'],
+    packages=['mongom2m', 'mongom2m_testapp', 'mongom2m_testapp.management', 'mongom2m_testapp.management.commands'],
     url='https://github.com/kennu/django-mongom2m',
     license='BSD licence, see LICENCE.txt',
     description='A ManyToManyField for django-mongodb-engine',